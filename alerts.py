@@ -0,0 +1,537 @@
+# alerts.py — 后台告警评估器：按 (标的, 周期) 增量维护指标状态，每根K线收盘后评估信号并推送
+#
+# 用法：
+#   python alerts.py run --config alerts.json            # 按配置文件运行
+#   python alerts.py run --symbols BTC-USDT,ETH-USDT --interval 15m --webhook http://127.0.0.1:8787/ --stdout
+#   python alerts.py sink --port 8787                    # 本地 HTTP 接收端，便于联调 webhook
+import argparse
+import json
+import math
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import requests
+
+from resample import parse_interval
+from sources import OKX_PUBLIC_BASES, RateLimiter, fetch_okx, fetch_yf
+from vwap import IncrementalVWAP, segment_ids
+
+DEFAULT_RULES = ["MA_Cross", "MACD_Cross", "RSI_Overbought", "RSI_Oversold",
+                 "KDJ_Cross", "KDJ_Overbought", "KDJ_Oversold", "ZLEMA_Flip"]
+# 页面 detect_signals 没有的规则：需在 rules 中显式列出才启用
+OPTIONAL_RULES = ["VWAP_Cross"]
+
+DEFAULT_PARAMS = {
+    "ma_fast": 20, "ma_slow": 50,
+    "macd_fast": 12, "macd_slow": 26, "macd_sig": 9,
+    "rsi_window": 14, "rsi_high": 70, "rsi_low": 30,
+    "kdj_window": 9, "kdj_smooth_k": 3, "kdj_smooth_d": 3, "kdj_high": 80, "kdj_low": 20,
+    "zlema_length": 70, "zlema_mult": 1.2,
+    "vwap_reset": "1D",  # VWAP 重置周期：1D/1W/1M，None 为全历史累计（按 UTC 切分）
+}
+
+
+# ========================= 增量指标（与 pandas / ta 的批量计算口径一致） =========================
+class EMA:
+    """指数均线。adjust=False 对应 ta 的 _ema（min_periods=span）；adjust=True 对应 pandas ewm 默认"""
+
+    def __init__(self, alpha, adjust=False, min_periods=0):
+        self.alpha, self.adjust, self.min_periods = alpha, adjust, min_periods
+        self.num = self.den = 0.0
+        self.value = math.nan
+        self.count = 0
+
+    def update(self, x):
+        if x is None or math.isnan(x):
+            return self.value if self.count >= self.min_periods else math.nan
+        self.count += 1
+        if self.adjust:
+            self.num = x + (1 - self.alpha) * self.num
+            self.den = 1 + (1 - self.alpha) * self.den
+            self.value = self.num / self.den
+        else:
+            self.value = x if self.count == 1 else (1 - self.alpha) * self.value + self.alpha * x
+        return self.value if self.count >= self.min_periods else math.nan
+
+
+class RollingMean:
+    def __init__(self, n):
+        self.n, self.buf = n, deque(maxlen=n)
+
+    def update(self, x):
+        self.buf.append(x)
+        return sum(self.buf) / self.n if len(self.buf) == self.n else math.nan
+
+
+class RollingExtreme:
+    """单调队列维护滑动窗口最大/最小值，均摊 O(1)"""
+
+    def __init__(self, n, mode="max"):
+        self.n, self.sign = n, 1.0 if mode == "max" else -1.0
+        self.q = deque()
+        self.i = 0
+
+    def update(self, x):
+        while self.q and self.sign * (x - self.q[-1][1]) >= 0:
+            self.q.pop()
+        self.q.append((self.i, x))
+        while self.q[0][0] <= self.i - self.n:
+            self.q.popleft()
+        self.i += 1
+        return self.q[0][1] if self.i >= self.n else math.nan
+
+
+class WilderATR:
+    """与 ta.volatility.AverageTrueRange 一致：前 n 根为 0，第 n 根为前 n 个 TR 的均值，之后 Wilder 平滑"""
+
+    def __init__(self, n):
+        self.n, self.prev_close, self.trs, self.value, self.i = n, None, [], 0.0, 0
+
+    def update(self, h, l, c):
+        tr = h - l if self.prev_close is None else max(h - l, abs(h - self.prev_close), abs(l - self.prev_close))
+        self.prev_close = c
+        self.i += 1
+        if self.i < self.n:
+            self.trs.append(tr)
+            return 0.0
+        if self.i == self.n:
+            self.value = (sum(self.trs) + tr) / self.n
+            self.trs = []
+        else:
+            self.value = (self.value * (self.n - 1) + tr) / self.n
+        return self.value
+
+
+class SymbolState:
+    """单个 (标的, 周期) 的增量状态：每根收盘K线 O(1) 更新，返回本根触发的信号列表
+
+    信号口径与页面上的 detect_signals / ZLEMA 趋势反转一致；超买超卖类规则按“进入区域”
+    的边沿触发，避免在区域内每根K线重复告警。可选规则 VWAP_Cross 为收盘价穿越分段 VWAP
+    （vwap.IncrementalVWAP，与页面 VWAP 同一算法），页面信号中没有对应项，默认不启用。
+    """
+
+    def __init__(self, params=None):
+        p = {**DEFAULT_PARAMS, **(params or {})}
+        self.p = p
+        self.ma_fast, self.ma_slow = RollingMean(p["ma_fast"]), RollingMean(p["ma_slow"])
+        self.ema_fast = EMA(2 / (p["macd_fast"] + 1), min_periods=p["macd_fast"])
+        self.ema_slow = EMA(2 / (p["macd_slow"] + 1), min_periods=p["macd_slow"])
+        self.macd_sig = EMA(2 / (p["macd_sig"] + 1), min_periods=p["macd_sig"])
+        self.rsi_up = EMA(1 / p["rsi_window"], min_periods=p["rsi_window"])
+        self.rsi_dn = EMA(1 / p["rsi_window"], min_periods=p["rsi_window"])
+        self.kdj_low, self.kdj_high = RollingExtreme(p["kdj_window"], "min"), RollingExtreme(p["kdj_window"], "max")
+        self.kdj_k = EMA(1 / p["kdj_smooth_k"], adjust=True)
+        self.kdj_d = EMA(1 / p["kdj_smooth_d"], adjust=True)
+        L = p["zlema_length"]
+        self.z_lag = int((L - 1) / 2)
+        self.z_closes = deque(maxlen=self.z_lag + 1)
+        self.z_ema = EMA(2 / (L + 1), adjust=True)
+        self.z_atr = WilderATR(L)
+        self.z_vol = RollingExtreme(L * 3, "max")
+        self.vwap = IncrementalVWAP()
+        self.vwap_day, self.vwap_seg = None, None if p["vwap_reset"] else 0
+        self.trend = 0
+        self.prev = {}
+        self.prev_close = None
+        self.last_ts = None
+        self.bars = 0
+
+    def update(self, ts, o, h, l, c, v=None):
+        p = self.p
+        cur = {}
+        cur["ma_fast"], cur["ma_slow"] = self.ma_fast.update(c), self.ma_slow.update(c)
+        ef, es = self.ema_fast.update(c), self.ema_slow.update(c)
+        cur["macd"] = ef - es
+        cur["macd_sig"] = self.macd_sig.update(cur["macd"])
+        diff = 0.0 if self.prev_close is None else c - self.prev_close
+        up, dn = self.rsi_up.update(max(diff, 0.0)), self.rsi_dn.update(max(-diff, 0.0))
+        cur["rsi"] = math.nan if math.isnan(dn) else (100.0 if dn == 0 else 100 - 100 / (1 + up / dn))
+        lo, hi = self.kdj_low.update(l), self.kdj_high.update(h)
+        rsv = (c - lo) / (hi - lo) * 100 if not math.isnan(lo) and hi != lo else math.nan
+        cur["k"] = self.kdj_k.update(rsv)
+        cur["d"] = self.kdj_d.update(cur["k"])
+        self.z_closes.append(c)
+        src = c + (c - self.z_closes[0]) if len(self.z_closes) > self.z_lag else math.nan
+        z = self.z_ema.update(src)
+        band = self.z_vol.update(self.z_atr.update(h, l, c)) * p["zlema_mult"]
+        # 分段 VWAP：段号只在跨日时重新计算
+        if p["vwap_reset"]:
+            day = int(_utc_seconds(ts) // 86400)
+            if day != self.vwap_day:
+                self.vwap_day = day
+                self.vwap_seg = int(segment_ids(pd.DatetimeIndex([pd.Timestamp(ts)]), p["vwap_reset"])[0])
+        cur["close"] = c
+        cur["vwap"], cur["vwap_std"] = self.vwap.update(self.vwap_seg, (h + l + c) / 3, math.nan if v is None else v)
+        prev_trend = self.trend
+        if not math.isnan(z) and not math.isnan(band):
+            if c > z + band:
+                self.trend = 1
+            elif c < z - band:
+                self.trend = -1
+        self.prev_close, self.last_ts = c, ts
+        self.bars += 1
+
+        events = []
+        pv = self.prev
+        if pv:
+            def cross(a, b, name):
+                if cur[a] > cur[b] and pv[a] <= pv[b]:
+                    events.append((name, "Buy"))
+                elif cur[a] < cur[b] and pv[a] >= pv[b]:
+                    events.append((name, "Sell"))
+            cross("ma_fast", "ma_slow", "MA_Cross")
+            cross("macd", "macd_sig", "MACD_Cross")
+            cross("k", "d", "KDJ_Cross")
+            cross("close", "vwap", "VWAP_Cross")
+            if cur["rsi"] > p["rsi_high"] and not pv["rsi"] > p["rsi_high"]:
+                events.append(("RSI_Overbought", "Sell"))
+            if cur["rsi"] < p["rsi_low"] and not pv["rsi"] < p["rsi_low"]:
+                events.append(("RSI_Oversold", "Buy"))
+            if cur["k"] > p["kdj_high"] and not pv["k"] > p["kdj_high"]:
+                events.append(("KDJ_Overbought", "Sell"))
+            if cur["k"] < p["kdj_low"] and not pv["k"] < p["kdj_low"]:
+                events.append(("KDJ_Oversold", "Buy"))
+        if self.trend != prev_trend and self.trend != 0:
+            events.append(("ZLEMA_Flip", "Buy" if self.trend == 1 else "Sell"))
+        self.prev = cur
+        return events, cur
+
+
+# ========================= 告警与推送 =========================
+@dataclass
+class Alert:
+    source: str
+    symbol: str
+    interval: str
+    rule: str
+    side: str
+    bar_time: str
+    close: float
+    bar_close_ts: float
+    emitted_ts: float = field(default_factory=time.time)
+
+    @property
+    def latency_s(self):
+        return self.emitted_ts - self.bar_close_ts
+
+    def payload(self):
+        return {**asdict(self), "latency_s": round(self.latency_s, 3)}
+
+
+class StdoutSink:
+    def send(self, alert):
+        print(json.dumps(alert.payload(), ensure_ascii=False), flush=True)
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alert):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(alert.payload(), ensure_ascii=False) + "\n")
+
+
+class WebhookSink:
+    def __init__(self, url, timeout=5.0, retries=3, backoff=0.5):
+        self.url, self.timeout, self.retries, self.backoff = url, timeout, retries, backoff
+        self.session = requests.Session()
+
+    def send(self, alert):
+        """只对连接错误、超时、5xx 与 429 退避重试；其他 4xx（地址错误、鉴权失败等）重试无用，直接抛出"""
+        for i in range(self.retries):
+            try:
+                r = self.session.post(self.url, json=alert.payload(), timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if i == self.retries - 1:
+                    raise
+            else:
+                if r.status_code < 400:
+                    return
+                if (r.status_code < 500 and r.status_code != 429) or i == self.retries - 1:
+                    r.raise_for_status()
+            time.sleep(self.backoff * (2 ** i))
+
+
+def make_sink(cfg):
+    kind = cfg.get("type")
+    if kind == "webhook":
+        return WebhookSink(cfg["url"], timeout=cfg.get("timeout", 5.0), retries=cfg.get("retries", 3))
+    if kind == "file":
+        return FileSink(cfg["path"])
+    if kind == "stdout":
+        return StdoutSink()
+    raise ValueError(f"未知的 sink 类型: {kind}")
+
+
+class Dispatcher:
+    """去重 + 冷却后放入队列，由独立线程推送到各 sink，慢速 webhook 不阻塞评估循环"""
+
+    def __init__(self, sinks, cooldown_s=0.0, dedup_size=10000, on_error=None):
+        self.sinks, self.cooldown_s = sinks, cooldown_s
+        self.seen = set()
+        self.seen_order = deque(maxlen=dedup_size)
+        self.last_fired = {}
+        self.q = queue.Queue()
+        self.on_error = on_error or (lambda sink, alert, e: print(f"[alerts] 推送失败 {type(sink).__name__}: {e}", file=sys.stderr))
+        self.sent = self.suppressed = 0
+        self._worker = threading.Thread(target=self._run, name="alert-dispatch", daemon=True)
+        self._worker.start()
+
+    def submit(self, alert):
+        key = (alert.source, alert.symbol, alert.interval, alert.rule, alert.side, alert.bar_time)
+        if key in self.seen:
+            self.suppressed += 1
+            return False
+        ck = (alert.source, alert.symbol, alert.interval, alert.rule)
+        last = self.last_fired.get(ck)
+        if last is not None and alert.bar_close_ts - last < self.cooldown_s:
+            self.suppressed += 1
+            return False
+        if len(self.seen_order) == self.seen_order.maxlen:
+            self.seen.discard(self.seen_order[0])
+        self.seen_order.append(key)
+        self.seen.add(key)
+        self.last_fired[ck] = alert.bar_close_ts
+        self.q.put(alert)
+        return True
+
+    def _run(self):
+        while True:
+            alert = self.q.get()
+            if alert is None:
+                break
+            for sink in self.sinks:
+                try:
+                    sink.send(alert)
+                except Exception as e:
+                    self.on_error(sink, alert, e)
+            self.sent += 1
+            self.q.task_done()
+
+    def flush(self):
+        self.q.join()
+
+
+# ========================= 调度 =========================
+def bar_close_time(ts, interval):
+    """K线开盘时间 → 收盘时间"""
+    unit, n = parse_interval(interval)
+    ts = pd.Timestamp(ts)
+    if unit == "min":
+        return ts + pd.Timedelta(minutes=n)
+    if unit == "W":
+        return ts + pd.Timedelta(weeks=n)
+    return ts + pd.DateOffset(months=n)
+
+
+def _utc_seconds(ts):
+    ts = pd.Timestamp(ts)
+    return (ts.tz_convert("UTC") if ts.tz is not None else ts.tz_localize("UTC")).timestamp()
+
+
+def fetch_recent(source, symbol, interval, limit):
+    if source == "okx":
+        return fetch_okx(OKX_PUBLIC_BASES[0], symbol, interval, timeout=10, limit=limit)
+    if source == "yf":
+        return fetch_yf(symbol, interval, period="5d" if (parse_interval(interval) or ("min", 0))[1] < 1440 else "2y")
+    raise ValueError(f"未知数据源: {source}")
+
+
+class AlertEngine:
+    """按周期分组轮询：每个周期在K线收盘后 grace_s 秒统一拉取该周期下所有标的的最新几根K线，
+    只把“已收盘且未处理过”的K线送入各自的增量状态。评估为 O(1)，延迟主要取决于拉取并发与限速：
+    同一周期的 N 个标的一轮约需 N / rate 秒，最后一个标的的收盘到推送延迟随之增加（300 个标的、10 次/秒约 30 秒）。
+    """
+
+    def __init__(self, watch, rules=None, params=None, sinks=None, cooldown_s=0.0, grace_s=2.0,
+                 workers=16, rate=10.0, warmup=300, fetch=fetch_recent, clock=time.time):
+        self.watch = [tuple(w) for w in watch]
+        self.rules = set(rules or DEFAULT_RULES)
+        self.params = params or {}
+        self.dispatcher = Dispatcher(sinks or [StdoutSink()], cooldown_s=cooldown_s)
+        self.grace_s, self.warmup = grace_s, warmup
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="alert-fetch")
+        self.limiter = RateLimiter(rate)
+        self.fetch, self.clock = fetch, clock
+        self.states = {w: SymbolState(self.params) for w in self.watch}
+        self.latencies = deque(maxlen=1000)
+
+    def _fetch(self, w, limit):
+        self.limiter.acquire()
+        source, symbol, interval = w
+        try:
+            return w, self.fetch(source, symbol, interval, limit)
+        except Exception as e:
+            print(f"[alerts] 拉取失败 {w}: {e}", file=sys.stderr)
+            return w, pd.DataFrame()
+
+    def feed(self, w, df, now=None, emit=True):
+        """把 df 中已收盘且比已处理更新的K线送入状态机；返回提交的告警"""
+        now = self.clock() if now is None else now
+        st = self.states[w]
+        source, symbol, interval = w
+        out = []
+        vol = df["Volume"] if "Volume" in df.columns else [None] * len(df)
+        for ts, o, h, l, c, v in zip(df.index, df["Open"], df["High"], df["Low"], df["Close"], vol):
+            if st.last_ts is not None and ts <= st.last_ts:
+                continue
+            close_ts = _utc_seconds(bar_close_time(ts, interval))
+            if close_ts > now:
+                break  # 未收盘的K线不参与评估
+            events, _ = st.update(ts, float(o), float(h), float(l), float(c), v)
+            if not emit:
+                continue
+            for rule, side in events:
+                if rule not in self.rules:
+                    continue
+                alert = Alert(source, symbol, interval, rule, side, str(ts), float(c), close_ts, self.clock())
+                if self.dispatcher.submit(alert):
+                    self.latencies.append(alert.latency_s)
+                    out.append(alert)
+        return out
+
+    def prime(self):
+        """用历史K线预热状态（不告警）"""
+        for w, df in self.pool.map(lambda w: self._fetch(w, self.warmup), self.watch):
+            if not df.empty:
+                self.feed(w, df, emit=False)
+
+    def poll(self, intervals=None, limit=5):
+        targets = [w for w in self.watch if intervals is None or w[2] in intervals]
+        alerts = []
+        for w, df in self.pool.map(lambda w: self._fetch(w, limit), targets):
+            if not df.empty:
+                alerts += self.feed(w, df)
+        return alerts
+
+    def next_due(self, now):
+        """各周期下一次收盘时间（UTC 秒）
+
+        按已处理的最后一根K线的开盘时间推算K线网格，而不是假定按 UTC 整点对齐：
+        OKX 的 6H/12H/1D 等按香港时间（UTC+8）开盘，UTC 网格会晚数小时才轮询。
+        """
+        due = {}
+        for interval in {w[2] for w in self.watch}:
+            unit, n = parse_interval(interval)
+            last = [s.last_ts for k, s in self.states.items() if k[2] == interval and s.last_ts is not None]
+            if unit == "min":
+                step = n * 60
+                anchor = _utc_seconds(max(last)) if last else 0.0
+                due[interval] = anchor + ((now - anchor) // step + 1) * step
+            else:
+                # 周/月线：最后一根的下一根的收盘时间
+                due[interval] = _utc_seconds(bar_close_time(bar_close_time(max(last), interval), interval)) if last else now + 3600
+        return due
+
+    def run_forever(self, stop=None):
+        stop = stop or threading.Event()
+        self.prime()
+        while not stop.is_set():
+            now = self.clock()
+            due = self.next_due(now)
+            t = min(due.values())
+            if stop.wait(max(0.0, t + self.grace_s - now)):
+                break
+            ready = {iv for iv, d in due.items() if d <= t}
+            alerts = self.poll(ready)
+            if alerts:
+                lat = sorted(self.latencies)
+                print(f"[alerts] {len(alerts)} 条告警，收盘→推送延迟 p50={lat[len(lat) // 2]:.2f}s "
+                      f"max={lat[-1]:.2f}s", file=sys.stderr)
+        self.dispatcher.flush()
+
+
+# ========================= 本地 HTTP 接收端（联调用） =========================
+def serve_sink(port=8787, host="127.0.0.1", out=None):
+    """启动一个打印收到的 JSON 告警的 HTTP 服务，返回 server（serve_forever 需调用方执行）"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                received.append(json.loads(body))
+            except ValueError:
+                received.append(body.decode("utf-8", "replace"))
+            print(body.decode("utf-8", "replace"), file=out or sys.stdout, flush=True)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.received = received
+    return server
+
+
+def _parse_args(argv):
+    ap = argparse.ArgumentParser(description="Legend Quant 后台告警评估器")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="运行告警评估")
+    run.add_argument("--config", help="JSON 配置文件（watch/rules/params/sinks/cooldown_s 等）")
+    run.add_argument("--source", default="okx", choices=["okx", "yf"])
+    run.add_argument("--symbols", default="", help="逗号分隔的标的")
+    run.add_argument("--interval", default="15m")
+    run.add_argument("--rules", default="", help=f"逗号分隔的规则，默认 {','.join(DEFAULT_RULES)}；"
+                                                 f"可选 {','.join(OPTIONAL_RULES)}")
+    run.add_argument("--webhook", action="append", default=[])
+    run.add_argument("--file", dest="files", action="append", default=[])
+    run.add_argument("--stdout", action="store_true")
+    run.add_argument("--cooldown", type=float, default=0.0, help="同一标的同一规则的冷却秒数")
+    run.add_argument("--rate", type=float, default=10.0,
+                     help="每秒最多请求数；同一周期 N 个标的一轮约需 N/rate 秒（OKX 公共行情接口约 20 次/秒/IP）")
+    run.add_argument("--workers", type=int, default=16)
+    sink = sub.add_parser("sink", help="启动本地 HTTP 接收端")
+    sink.add_argument("--port", type=int, default=8787)
+    sink.add_argument("--host", default="127.0.0.1")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    if args.cmd == "sink":
+        server = serve_sink(args.port, args.host)
+        print(f"[alerts] 本地接收端 http://{args.host}:{args.port}/", file=sys.stderr)
+        server.serve_forever()
+        return
+    cfg = {}
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            cfg = json.load(f)
+    watch = [(w["source"], w["symbol"], w["interval"]) for w in cfg.get("watch", [])]
+    watch += [(args.source, s.strip(), args.interval) for s in args.symbols.split(",") if s.strip()]
+    sinks_cfg = cfg.get("sinks", []) + [{"type": "webhook", "url": u} for u in args.webhook] + \
+        [{"type": "file", "path": p} for p in args.files] + ([{"type": "stdout"}] if args.stdout else [])
+    if not watch:
+        raise SystemExit("没有需要监控的标的：请使用 --symbols 或配置文件中的 watch")
+    engine = AlertEngine(
+        watch,
+        rules=[r for r in args.rules.split(",") if r] or cfg.get("rules"),
+        params=cfg.get("params"),
+        sinks=[make_sink(c) for c in sinks_cfg] or [StdoutSink()],
+        cooldown_s=cfg.get("cooldown_s", args.cooldown),
+        rate=cfg.get("rate", args.rate),
+        workers=cfg.get("workers", args.workers),
+    )
+    _rate = cfg.get("rate", args.rate)
+    _group = max(Counter(w[2] for w in watch).values())
+    if _group / _rate > 5:
+        print(f"[alerts] 同一周期 {_group} 个标的、限速 {_rate:g} 次/秒：一轮拉取约 {_group / _rate:.0f} 秒，"
+              f"收盘到推送的延迟会随之增加，可调高 --rate（不超过数据源限额）", file=sys.stderr)
+    try:
+        engine.run_forever()
+    except KeyboardInterrupt:
+        engine.dispatcher.flush()
+
+
+if __name__ == "__main__":
+    main()
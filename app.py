@@ -2,14 +2,29 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import requests
-import yfinance as yf
 import plotly.graph_objects as go
 import plotly.express as px
 import ta
 import math
+import os
 from datetime import datetime
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from failover import FailoverPolicy, ProviderHealth, hedged_fetch
+from sources import (FINNHUB_CHUNK_DAYS, OKX_PUBLIC_BASES, YF_INTRADAY_LIMITS, RateLimiter, fetch_cg_market_chart,
+                     fetch_cg_ohlc, fetch_chunked, fetch_finnhub_range, fetch_okx, fetch_okx_closes, fetch_tokeninsight,
+                     fetch_yf, fetch_yf_closes, fetch_yf_range, plan_chunks)
+from resample import SESSIONS, can_derive, detect_gaps, interval_minutes, parse_interval, resample_ohlcv
+from ml_rsi import adaptive_thresholds
+from shm_cache import SharedFrameCache
+from vwap import RESET_MODES, anchor_positions, anchored_vwaps, segment_ids, segmented_vwap, typical_price
+from perf import MetricsRegistry, ProfileCapture, Tracer, append_jsonl, mark_cache_miss, write_atomic
+from cross_asset import cross_asset_snapshot
+from risk import RiskParams, position_size, simulate_paths
+from replay import SPEEDS, ReplayPlan, ReplayStats, bar_seconds, frame_at, run_replay
+from zigzag import EXTENSIONS, fib_levels, swing_legs, swing_pivots
 
 st.set_page_config(page_title="Legend Quant Terminal Elite v5", layout="wide")
 
@@ -30,6 +45,49 @@ if auto_refresh:
     # from streamlit_autorefresh import st_autorefresh
     # st_autorefresh(interval=refresh_interval * 1000, key="auto_refresh")
 
+# 主机级共享缓存：多副本部署时设置环境变量 LQT_SHARED_CACHE_DIR 启用（如 /dev/shm/lqt-cache）
+@st.cache_resource
+def get_shared_cache():
+    root = os.environ.get("LQT_SHARED_CACHE_DIR", "")
+    if not root:
+        return None
+    return SharedFrameCache(root, ttl=int(os.environ.get("LQT_SHARED_CACHE_TTL", "900")))
+
+# ========================= 性能诊断（默认关闭，关闭时几乎无开销） =========================
+with st.sidebar.expander("⏱️ 性能诊断", expanded=False):
+    perf_enabled = st.checkbox("启用耗时统计", value=False, help="统计数据加载、指标、信号、图表构建与序列化各阶段耗时")
+    # 导出路径只取自服务端环境变量，不接受页面输入（否则任何访客都能写/覆盖主机上的任意文件）
+    perf_log_path = os.environ.get("LQT_PERF_LOG", "")
+    perf_prom_path = os.environ.get("LQT_PERF_PROM", "")
+    st.caption(f"JSON 日志（LQT_PERF_LOG）：{'已配置' if perf_log_path else '未配置'}；"
+               f"Prometheus 文本（LQT_PERF_PROM，可配合 node_exporter textfile collector）：{'已配置' if perf_prom_path else '未配置'}")
+    st.markdown("**单次重跑剖析（cProfile + tracemalloc）**")
+    profile_clear_cache = st.checkbox("采集时绕过数据缓存", value=False,
+                                      help="本次剖析中加载函数直接执行（不读写进程内缓存与共享缓存），以便剖析网络与解析开销；不影响其他会话")
+    profile_requested = st.button("📸 剖析本次重跑", use_container_width=True)
+    if get_shared_cache() is not None:
+        st.markdown(f"**主机级共享缓存**：`{get_shared_cache().root}`")
+        _entries = get_shared_cache().entries()
+        if not _entries.empty:
+            st.dataframe(_entries, hide_index=True, use_container_width=True)
+tracer = Tracer(enabled=perf_enabled)
+
+# 上一次采集若因 st.stop() 等提前结束未能收尾，先停止，避免剖析器残留在脚本线程上
+_stale_profile = st.session_state.pop("_active_profile", None)
+if _stale_profile is not None:
+    _stale_profile.stop()
+profile_capture = None
+# 只对本次重跑生效：_load 直接调用未缓存的加载函数，不清空其他会话共用的缓存
+profile_bypass_cache = profile_requested and profile_clear_cache
+if profile_requested:
+    profile_capture = ProfileCapture()
+    st.session_state["_active_profile"] = profile_capture
+    profile_capture.start()
+
+@st.cache_resource
+def get_metrics_registry():
+    return MetricsRegistry()
+
 # ========================= Sidebar: ① 数据来源与标的 =========================
 st.sidebar.header("① 数据来源与标的")
 source = st.sidebar.selectbox(
@@ -63,18 +121,56 @@ elif source == "Finnhub API":
 # 标的与周期
 if source in ["CoinGecko（免API）", "TokenInsight API 模式（可填API基址）"]:
     symbol = st.sidebar.selectbox("个标（CoinGecko coin_id）", ["bitcoin","ethereum","solana","dogecoin","cardano","ripple","polkadot"], index=1)
-    interval = st.sidebar.selectbox("K线周期（映射）", ["1d","1w","1M","max"], index=0, help="CoinGecko/TokenInsight 免费接口多为日级/周级聚合，不提供细分分钟线。")
+    interval_choices = ["1d","1w","1M","max"]
+    interval = st.sidebar.selectbox("K线周期（映射）", interval_choices, index=0, help="CoinGecko/TokenInsight 免费接口多为日级/周级聚合，不提供细分分钟线。")
 elif source in ["OKX 公共行情（免API）", "OKX API（可填API基址）"]:
     symbol = st.sidebar.selectbox("个标（OKX InstId）", ["BTC-USDT","ETH-USDT","SOL-USDT","XRP-USDT","DOGE-USDT"], index=1)
-    interval = st.sidebar.selectbox("K线周期", ["1m","3m","5m","15m","30m","1H","2H","4H","6H","12H","1D","1W","1M"], index=3)
+    interval_choices = ["1m","3m","5m","15m","30m","1H","2H","4H","6H","12H","1D","1W","1M"]
+    interval = st.sidebar.selectbox("K线周期", interval_choices, index=3)
 elif source == "Finnhub API":
     # Finnhub API特定的输入
     symbol = st.sidebar.text_input("个标（Finnhub symbol）", value="AAPL")
-    interval = st.sidebar.selectbox("K线周期", ["1", "5", "15", "30", "60", "D", "W", "M"], index=0,
+    interval_choices = ["1", "5", "15", "30", "60", "D", "W", "M"]
+    interval = st.sidebar.selectbox("K线周期", interval_choices, index=0,
                                   help="Finnhub支持的周期：1,5,15,30,60分钟,D=日,W=周,M=月")
 else:
     symbol = st.sidebar.selectbox("个标（美股/A股）", ["AAPL","TSLA","MSFT","NVDA","600519.SS","000001.SS"], index=0)
-    interval = st.sidebar.selectbox("K线周期", ["1d","1wk","1mo"], index=0)
+    interval_choices = ["1m","5m","15m","30m","1h","1d","1wk","1mo"]
+    interval = st.sidebar.selectbox("K线周期", interval_choices, index=5,
+                                  help="分钟线受 Yahoo 限制：1m 最多回溯 30 天，5m–30m 最多 60 天，1h 最多 730 天")
+
+# 分钟线按时间范围分块并发拉取；每块单独缓存，范围重叠时只拉缺失的块
+history_days = None
+if source == "Finnhub API":
+    _default_days = {"1": 7, "5": 30, "15": 60, "30": 120, "60": 365}.get(interval, 365)
+    history_days = st.sidebar.number_input("历史范围（天）", min_value=1, max_value=3650, value=_default_days, step=1,
+                                           help=f"按每块 {FINNHUB_CHUNK_DAYS.get(interval, 3650)} 天拆分请求")
+elif source == "Yahoo Finance（美股/A股）" and interval in YF_INTRADAY_LIMITS:
+    _chunk_days, _max_days = YF_INTRADAY_LIMITS[interval]
+    history_days = st.sidebar.number_input("历史范围（天）", min_value=1, max_value=_max_days, value=min(_max_days, 60), step=1,
+                                           help=f"{interval} 最多回溯 {_max_days} 天，按每块 {_chunk_days} 天拆分请求")
+
+# ===== 本地重采样：高周期由已加载的基础周期聚合，切换周期无需重新请求 =====
+with st.sidebar.expander("🧱 本地重采样（高周期由基础周期聚合）", expanded=False):
+    # 基础周期与目标周期独立选择（固定 key），切换目标周期时沿用同一份基础数据；默认取能聚合出当前周期的最粗基础周期
+    _base_choices = [i for i in interval_choices if (parse_interval(i) or ("",))[0] == "min"]
+    _derivable = [i for i in _base_choices if i != interval and can_derive(i, interval)]
+    if st.session_state.get("resample_base") not in _base_choices:
+        st.session_state.pop("resample_base", None)
+    use_local_resample = st.checkbox("启用本地重采样", value=False, disabled=not _base_choices,
+                                     help="只请求一次基础周期数据，2H/4H/1W 等更高周期在本地聚合并缓存")
+    base_interval = st.selectbox("基础周期", _base_choices or ["—"], key="resample_base", disabled=not _base_choices,
+                                 index=_base_choices.index(_derivable[-1]) if _derivable else 0,
+                                 help="基础周期越细，数据源单次返回的K线覆盖的时间越短，聚合后的高周期K线越少")
+    if use_local_resample and base_interval not in _derivable and base_interval != interval:
+        st.caption(f"{interval} 不能由 {base_interval} 聚合（需为其整数倍且更粗），本周期直接请求")
+    if source in ["Yahoo Finance（美股/A股）", "Finnhub API"]:
+        _default_session = 1 if not (symbol.endswith(".SS") or symbol.endswith(".SZ")) else 2
+    else:
+        _default_session = 0
+    session_name = st.selectbox("交易时段", list(SESSIONS.keys()), index=_default_session,
+                                help="股票按交易所时段切分日内K线，并只在交易时段内检测缺口")
+    use_local_resample = use_local_resample and base_interval in _derivable
 
 # ========================= Sidebar: ③ 指标与参数（顶级交易员常用） =========================
 st.sidebar.header("③ 指标与参数（顶级交易员常用）")
@@ -97,6 +193,11 @@ atr_window = st.sidebar.number_input("ATR 窗口", min_value=5, value=14, step=1
 # ===== 新增：更多常用指标 =====
 st.sidebar.markdown("**（新增）更多常用指标**")
 use_vwap = st.sidebar.checkbox("VWAP（成交量加权均价）", True)
+_intraday = (interval_minutes(interval) or 1440) < 1440
+vwap_reset = st.sidebar.selectbox("VWAP 重置周期", list(RESET_MODES.keys()), index=0 if _intraday else 2,
+                                  help="按交易时段（见“本地重采样”中的交易时段设置）所在时区切分日/周/月")
+vwap_bands_text = st.sidebar.text_input("VWAP 标准差带倍数（逗号分隔）", value="1,2")
+vwap_anchors_text = st.sidebar.text_input("锚定 VWAP 起点（逗号分隔）", value="", help="日期或日期时间，如 2024-01-01, 2024-03-15 09:30")
 use_adx = st.sidebar.checkbox("ADX（趋势强度）", True)
 adx_window = st.sidebar.number_input("ADX 窗口", min_value=5, value=14, step=1)
 use_stoch = st.sidebar.checkbox("Stochastic 随机指标（副图）", False)
@@ -135,6 +236,10 @@ ml_smooth_period = st.sidebar.number_input("平滑周期", min_value=1, value=4,
 ml_min_thresh = st.sidebar.number_input("聚类最小阈值", min_value=5, value=10, step=5)
 ml_max_thresh = st.sidebar.number_input("聚类最大阈值", min_value=50, value=90, step=5)
 ml_step = st.sidebar.number_input("聚类步长", min_value=1, value=5, step=1)
+ml_k = st.sidebar.selectbox("聚类数 k", [2, 3], index=1, help="k=3 时中间簇作为中性区")
+ml_window = st.sidebar.number_input("聚类窗口（根）", min_value=50, value=300, step=50)
+ml_iters = st.sidebar.number_input("每根K线迭代次数", min_value=1, max_value=10, value=2, step=1,
+                                   help="以上一根K线的质心为初值继续迭代（热启动）")
 
 # 3. Normalised T3 Oscillator
 use_norm_t3 = st.sidebar.checkbox("归一化T3振荡器", False)
@@ -191,6 +296,14 @@ risk_pct = st.sidebar.slider("单笔风险（%）", 0.1, 2.0, 0.5, 0.1)
 leverage = st.sidebar.slider("杠杆倍数", 1, 10, 1, 1)
 daily_loss_limit = st.sidebar.number_input("每日亏损阈值（%）", min_value=0.5, value=2.0, step=0.5)
 weekly_loss_limit = st.sidebar.number_input("每周亏损阈值（%）", min_value=1.0, value=5.0, step=0.5)
+with st.sidebar.expander("🎲 蒙特卡洛风险模拟", expanded=False):
+    use_risk_sim = st.checkbox("启用风险模拟", value=False, help="ATR 止损定仓，按本标的历史收益分布批量模拟资金曲线")
+    risk_atr_mult = st.number_input("止损 = ATR ×", min_value=0.5, value=2.0, step=0.5, disabled=not use_risk_sim)
+    risk_rr = st.number_input("止盈 = 止损距离 ×（0 = 不设）", min_value=0.0, value=2.0, step=0.5, disabled=not use_risk_sim)
+    risk_direction = st.radio("方向", ["做多", "做空"], horizontal=True, disabled=not use_risk_sim)
+    risk_days = st.number_input("模拟天数", min_value=1, max_value=250, value=20, step=5, disabled=not use_risk_sim)
+    risk_paths = st.select_slider("路径数", options=[5000, 10000, 20000, 50000], value=20000, disabled=not use_risk_sim)
+    risk_ruin_pct = st.number_input("破产线（初始资金 %）", min_value=1.0, max_value=99.0, value=50.0, step=5.0, disabled=not use_risk_sim)
 
 # ========================= 添加手动刷新按钮 =========================
 col1, col2, col3 = st.columns([6, 1, 2])
@@ -222,128 +335,253 @@ def _cg_days_from_interval(sel: str) -> str:
     if sel.startswith("max"): return "max"
     return "180"
 
-@st.cache_data(ttl=900, hash_funcs={"_thread.RLock": lambda _: None})
-def load_coingecko_ohlc_robust(coin_id: str, interval_sel: str):
+@st.cache_resource
+def get_provider_health():
+    # 进程级共享：各会话的请求结果共同决定数据源健康评分
+    return ProviderHealth()
+
+# ===== 数据源故障转移策略 =====
+with st.sidebar.expander("🛰️ 数据源故障转移", expanded=False):
+    failover_mode = st.selectbox("回退模式", ["对冲并发（推荐）", "顺序回退"], index=0,
+                                 help="对冲并发：首个数据源超过阈值未返回时，并发请求下一个等价数据源，取最先返回的有效结果")
+    hedge_after = st.number_input("对冲阈值（秒）", min_value=0.1, value=2.0, step=0.5,
+                                  disabled=(failover_mode == "顺序回退"))
+    request_timeout = st.number_input("单源超时（秒）", min_value=1.0, value=15.0, step=1.0)
+    total_timeout = st.number_input("整体超时（秒）", min_value=1.0, value=20.0, step=1.0)
+    use_health_order = st.checkbox("按健康评分排序数据源", value=True)
+    _health_df = get_provider_health().snapshot()
+    if not _health_df.empty:
+        st.dataframe(_health_df, hide_index=True, use_container_width=True)
+
+failover_policy = FailoverPolicy(
+    hedge_after=float(hedge_after) if failover_mode != "顺序回退" else math.inf,
+    request_timeout=float(request_timeout),
+    total_timeout=float(total_timeout),
+    use_health=use_health_order,
+)
+
+def _coingecko_providers(coin_id, interval_sel):
     days = _cg_days_from_interval(interval_sel)
-    try:
-        url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/ohlc"
-        r = requests.get(url, params={"vs_currency": "usd", "days": days}, timeout=20)
-        if r.status_code == 200:
-            arr = r.json()
-            if isinstance(arr, list) and len(arr) > 0:
-                rows = [(pd.to_datetime(x[0], unit="ms"), float(x[1]), float(x[2]), float(x[3]), float(x[4])) for x in arr]
-                return pd.DataFrame(rows, columns=["Date","Open","High","Low","Close"]).set_index("Date")
-    except Exception:
-        pass
-    try:
-        url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart"
-        params = {"vs_currency":"usd", "days": days if days != "max" else "365"}
-        r = requests.get(url, params=params, timeout=20)
-        r.raise_for_status()
-        data = r.json()
-        prices = data.get("prices", [])
-        if prices:
-            s = pd.Series(
-                [float(p[1]) for p in prices],
-                index=pd.to_datetime([int(p[0]) for p in prices], unit="ms"),
-                name="price"
-            ).sort_index()
-            ohlc = s.resample("1D").agg(["first","max","min","last"]).dropna()
-            ohlc.columns = ["Open","High","Low","Close"]
-            return ohlc
-    except Exception:
-        pass
-    return pd.DataFrame()
+    return [
+        ("CoinGecko /ohlc", lambda t, c: fetch_cg_ohlc(coin_id, days, t, c)),
+        ("CoinGecko /market_chart", lambda t, c: fetch_cg_market_chart(coin_id, days, t, c)),
+    ]
 
+# 以下划线开头的参数（_policy/_health）不参与 st.cache_data 的缓存键
 @st.cache_data(ttl=900, hash_funcs={"_thread.RLock": lambda _: None})
-def load_tokeninsight_ohlc(api_base_url: str, coin_id: str, interval_sel: str):
-    if not api_base_url:
-        return load_coingecko_ohlc_robust(coin_id, interval_sel)
-    try:
-        url = f"{api_base_url.rstrip('/')}/ohlc"
-        r = requests.get(url, params={"symbol": coin_id, "period": "1d"}, timeout=15)
-        r.raise_for_status()
-        data = r.json()
-        if isinstance(data, list) and data:
-            rows = [(pd.to_datetime(x[0], unit="ms"), float(x[1]), float(x[2]), float(x[3]), float(x[4])) for x in data]
-            return pd.DataFrame(rows, columns=["Date","Open","High","Low","Close"]).set_index("Date")
-    except Exception:
-        pass
-    return load_coingecko_ohlc_robust(coin_id, interval_sel)
+def load_coingecko_ohlc_robust(coin_id: str, interval_sel: str, _policy=None, _health=None):
+    mark_cache_miss()
+    df, _ = hedged_fetch(_coingecko_providers(coin_id, interval_sel), _policy, _health)
+    return df
 
 @st.cache_data(ttl=900, hash_funcs={"_thread.RLock": lambda _: None})
-def load_okx_public(instId: str, bar: str, base_url: str = ""):
-    url = (base_url.rstrip('/') if base_url else "https://www.okx.com") + "/api/v5/market/candles"
-    params = {"instId": instId, "bar": bar, "limit": "1000"}
-    r = requests.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json().get("data", [])
-    if not data: return pd.DataFrame()
-    rows = []
-    for a in reversed(data):
-        ts = int(a[0]); o=float(a[1]); h=float(a[2]); l=float(a[3]); c=float(a[4]); v=float(a[5])
-        rows.append((pd.to_datetime(ts, unit="ms"), o,h,l,c,v))
-    return pd.DataFrame(rows, columns=["Date","Open","High","Low","Close","Volume"]).set_index("Date")
+def load_tokeninsight_ohlc(api_base_url: str, coin_id: str, interval_sel: str, _policy=None, _health=None):
+    mark_cache_miss()
+    providers = _coingecko_providers(coin_id, interval_sel)
+    if api_base_url:
+        providers = [("TokenInsight", lambda t, c: fetch_tokeninsight(api_base_url, coin_id, t, c))] + providers
+    df, _ = hedged_fetch(providers, _policy, _health)
+    return df
+
+@st.cache_data(ttl=900, hash_funcs={"_thread.RLock": lambda _: None})
+def load_okx_public(instId: str, bar: str, base_url: str = "", _policy=None, _health=None):
+    mark_cache_miss()
+    bases = ([base_url] if base_url else []) + OKX_PUBLIC_BASES
+    providers = [(f"OKX {b}", (lambda b: lambda t, c: fetch_okx(b, instId, bar, t, c))(b)) for b in bases]
+    df, _ = hedged_fetch(providers, _policy, _health)
+    return df
+
+# 分块请求的限速：每个数据源一个进程级令牌桶，所有会话、所有标的共用（Finnhub 免费档 60 次/分钟）
+CHUNK_RATE_LIMITS = {"finnhub": (1.0, 8), "yf": (2.0, 4)}
+
+@st.cache_resource
+def get_chunk_limiter(provider):
+    rate, burst = CHUNK_RATE_LIMITS[provider]
+    return RateLimiter(rate, burst)
+
+# 分块缓存：已结束的块内容不再变化，长期缓存；包含当前时刻的块使用短 TTL
+# req_start：首块按请求起点裁剪（参与缓存键），避免对齐的长块（日线 10 年一块）多拉请求范围之外的数据；请求终点裁剪到当前时刻
+# 下划线参数不参与缓存键：_misses 只在未命中（函数体真正执行）时记录，用于统计实际请求的块数；
+# _limiter 只在真正发请求时取令牌；_from 把请求起点裁剪到数据源允许的回溯范围内（越往后越晚，已缓存的块总是其超集）
+@st.cache_data(ttl=7 * 24 * 3600, max_entries=4096, show_spinner=False)
+def load_range_chunk(provider: str, symbol: str, interval_sel: str, start: int, end: int, api_key: str = "",
+                     req_start=None, _misses=None, _limiter=None, _from=None):
+    if _misses is not None:
+        _misses.append((start, end))
+    if _limiter is not None:
+        _limiter.acquire()
+    req_start, req_end = max(req_start or start, _from or 0), min(end, int(time.time()))
+    if provider == "finnhub":
+        return fetch_finnhub_range(symbol, interval_sel, req_start, req_end, api_key)
+    return fetch_yf_range(symbol, interval_sel, req_start, req_end)
+
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
+def load_live_chunk(provider: str, symbol: str, interval_sel: str, start: int, end: int, api_key: str = "",
+                    req_start=None, _misses=None, _limiter=None, _from=None):
+    return load_range_chunk.__wrapped__(provider, symbol, interval_sel, start, end, api_key, req_start,
+                                        _misses, _limiter, _from)
+
+def load_chunked(provider, symbol, interval_sel, days, chunk_days, api_key="", max_days=None):
+    """把最近 days 天切成对齐的块并发拉取；返回拼接后的 DataFrame，attrs["chunks"] 记录块统计
+
+    max_days：数据源允许的最大回溯天数（Yahoo 分钟线），对齐后超出部分不请求（留 1 小时余量）。
+    """
+    now = int(time.time())
+    start = now - int(days) * 86400
+    day0 = start // 86400 * 86400  # 首块裁剪到请求起点所在日的 0 点：缓存键当日内稳定
+    floor = now - int(max_days) * 86400 + 3600 if max_days else None
+    chunks = [ch for ch in plan_chunks(start, now, int(chunk_days) * 86400) if floor is None or ch[1] > floor]
+    misses, limiter = [], get_chunk_limiter(provider)
+    shared, ctx = get_shared_cache(), get_script_run_ctx()
+
+    def fetch(s, e):
+        add_script_run_ctx(threading.current_thread(), ctx)  # 工作线程挂上本次重跑的上下文，st.cache_data 才能正常使用
+        args = (provider, symbol, interval_sel, s, e, api_key, max(s, day0))
+        kw = {"_misses": misses, "_limiter": limiter, "_from": floor}
+        if profile_bypass_cache:
+            return load_range_chunk.__wrapped__(*args, **kw)
+        if shared is not None:  # 主机级共享缓存：各副本共用已拉取的块；未结束的块按 5 分钟分桶；键中不含 API Key（会写入磁盘）
+            key = ("chunk",) + args[:5] + args[6:] + ((now // 300,) if e > now else ())
+            return shared.get_or_load(key, lambda: load_range_chunk.__wrapped__(*args, **kw))
+        return (load_live_chunk if e > now else load_range_chunk)(*args, **kw)
+    df, failed = fetch_chunked(fetch, chunks, start=start, end=now, workers=4)
+    # 整体重设 attrs：单块时拼接结果会带上该块的 shared_version，而结果已按起止时间裁剪，不能当作共享缓存中的原始数据
+    df.attrs = {"chunks": {"total": len(chunks), "fetched": len(misses), "failed": [
+        f"{pd.Timestamp(s, unit='s'):%Y-%m-%d}~{pd.Timestamp(e, unit='s'):%Y-%m-%d}: {err}" for (s, e), err in failed]}}
+    return df
 
 @st.cache_data(ttl=900, hash_funcs={"_thread.RLock": lambda _: None})
 def load_yf(symbol: str, interval_sel: str):
+    mark_cache_miss()
     interval_map = {"1d":"1d","1wk":"1wk","1mo":"1mo"}
-    interval = interval_map.get(interval_sel, "1d")
-    df = yf.download(symbol, period="5y", interval=interval, progress=False, auto_adjust=False)
-    if not df.empty:
-        df = df[["Open","High","Low","Close","Volume"]].dropna()
+    return fetch_yf(symbol, interval_map.get(interval_sel, "1d"), period="5y")
+
+# 分钟线与 Finnhub 不再整体缓存：各时间块已分别缓存，整体缓存会把部分块失败的拼接结果保留一个 TTL，失败块迟迟不重试
+def load_yf_intraday(symbol: str, interval_sel: str, days: int = 0):
+    chunk_days, max_days = YF_INTRADAY_LIMITS[interval_sel]
+    return load_chunked("yf", symbol, interval_sel, min(int(days or max_days), max_days), chunk_days, max_days=max_days)
+
+def load_finnhub(symbol: str, api_key: str, interval_sel: str, days: int = 365):
+    df = load_chunked("finnhub", symbol, interval_sel, days, FINNHUB_CHUNK_DAYS.get(interval_sel, 3650), api_key)
+    if df.empty and df.attrs["chunks"]["failed"]:
+        st.error(f"Finnhub API error: {df.attrs['chunks']['failed'][0]}")
     return df
 
-@st.cache_data(ttl=900, hash_funcs={"_thread.RLock": lambda _: None})
-def load_finnhub(symbol: str, api_key: str, interval_sel: str):
-    try:
-        url = f"https://finnhub.io/api/v1/stock/candle"
-        params = {
-            "symbol": symbol,
-            "resolution": interval_sel,
-            "from": int(time.time()) - 365*24*60*60,  # 获取一年数据
-            "to": int(time.time()),
-            "token": api_key
-        }
-        r = requests.get(url, params=params, timeout=20)
-        r.raise_for_status()
-        data = r.json()
-        if data.get("s") == "ok":  # Finnhub成功响应格式
-            # 转换为DataFrame
-            df = pd.DataFrame({
-                "Date": pd.to_datetime(data["t"], unit="s"),
-                "Open": data["o"],
-                "High": data["h"],
-                "Low": data["l"],
-                "Close": data["c"],
-                "Volume": data["v"]
-            })
-            return df.set_index("Date")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Finnhub API error: {str(e)}")
-        return pd.DataFrame()
+def _load(name, fn, *args, key_args=None, **kwargs):
+    """共享缓存启用时绕过进程内 st.cache_data（每个进程各存一份），直接读写主机级 memmap 缓存"""
+    if profile_bypass_cache:
+        with tracer.span(f"load:{name}", parent="load_router"):
+            return fn.__wrapped__(*args, **kwargs)
+    shared = get_shared_cache()
+    if shared is None:
+        return tracer.cached_call(name, fn, *args, **kwargs)
+    key = (name,) + tuple(args if key_args is None else key_args) + \
+        tuple(sorted((k, v) for k, v in kwargs.items() if not k.startswith("_")))
+    return tracer.cached_call(name, shared.get_or_load, key, lambda: fn.__wrapped__(*args, **kwargs))
 
 def load_router(source, symbol, interval_sel, api_base="", api_key=""):
     # 使用refresh_counter确保每次刷新都重新加载数据
     _ = st.session_state.refresh_counter  # 确保这个函数在refresh_counter变化时重新运行
     if source == "CoinGecko（免API）":
-        return load_coingecko_ohlc_robust(symbol, interval_sel)
+        return _load("coingecko", load_coingecko_ohlc_robust, symbol, interval_sel, _policy=failover_policy, _health=get_provider_health())
     elif source == "TokenInsight API 模式（可填API基址）":
-        return load_tokeninsight_ohlc(api_base, symbol, interval_sel)
+        return _load("tokeninsight", load_tokeninsight_ohlc, api_base, symbol, interval_sel, _policy=failover_policy, _health=get_provider_health())
     elif source in ["OKX 公共行情（免API）", "OKX API（可填API基址）"]:
         base = api_base if source == "OKX API（可填API基址）" else ""
-        return load_okx_public(symbol, interval_sel, base_url=base)
+        return _load("okx", load_okx_public, symbol, interval_sel, base_url=base, _policy=failover_policy, _health=get_provider_health())
     elif source == "Finnhub API":  # 新增Finnhub支持
-        return load_finnhub(symbol, api_key, interval_sel)
+        # 按块缓存，不经过整体缓存与共享缓存（API Key 也就不会进入共享缓存键）
+        with tracer.span("load:finnhub", parent="load_router"):
+            return load_finnhub(symbol, api_key, interval_sel, int(history_days or 365))
+    elif interval_sel in YF_INTRADAY_LIMITS:
+        with tracer.span("load:yfinance", parent="load_router"):
+            return load_yf_intraday(symbol, interval_sel, int(history_days or 0))
     else:
-        return load_yf(symbol, interval_sel)
+        return _load("yfinance", load_yf, symbol, interval_sel)
+
+# 以 key 区分缓存条目，_base_df 不参与哈希，避免每次重跑都对整张表求哈希
+@st.cache_data(ttl=900, max_entries=64)
+def load_resampled(_base_df, key, target_interval, session_name):
+    mark_cache_miss()
+    session = SESSIONS[session_name]
+    return resample_ohlcv(_base_df, target_interval, session), detect_gaps(_base_df.index, key[2], session)
 
 # 加载数据
-df = load_router(source, symbol, interval, api_base, api_key)
+gaps = None
+if use_local_resample:
+    with tracer.span("load_router"):
+        base_df = load_router(source, symbol, base_interval, api_base, api_key)
+    if base_df.empty:
+        df = base_df
+    else:
+        _key = (source, symbol, base_interval, st.session_state.refresh_counter, len(base_df), str(base_df.index[-1]))
+        df, gaps = tracer.cached_call("resample", load_resampled, base_df, _key, interval, session_name, parent="")
+        if len(df) < 100:
+            st.warning(f"由 {base_interval} 聚合得到的 {interval} 只有 {len(df)} 根K线（基础周期单次可取的K线数有限），"
+                       f"已改为直接请求 {interval}；请换用更粗的基础周期")
+            with tracer.span("load_router"):
+                df, gaps = load_router(source, symbol, interval, api_base, api_key), None
+else:
+    with tracer.span("load_router"):
+        df = load_router(source, symbol, interval, api_base, api_key)
 if df.empty or not set(["Open","High","Low","Close"]).issubset(df.columns):
     st.error("数据为空或字段缺失：请更换数据源/周期，或稍后重试（免费源可能限流）。")
     st.stop()
+if gaps is not None and not gaps.empty:
+    with st.expander(f"⚠️ 基础周期 {base_interval} 数据存在 {len(gaps)} 处缺口（共缺 {int(gaps['missing_bars'].sum())} 根）", expanded=False):
+        st.dataframe(gaps, hide_index=True, use_container_width=True)
+_chunks = df.attrs.get("chunks")
+if _chunks:
+    st.caption(f"分块拉取：共 {_chunks['total']} 块（新拉取 {_chunks['fetched']} 块，其余复用分块缓存）")
+    if _chunks["failed"]:
+        with st.expander(f"⚠️ {len(_chunks['failed'])} 个时间块拉取失败（其余数据已拼接显示，刷新时会重试）", expanded=False):
+            st.write("\n".join(f"- {e}" for e in _chunks["failed"]))
+
+# ========================= 行情回放：把已加载的历史按倍速逐根/逐 tick 重放，走完整的指标→信号→图表链路 =========================
+with st.sidebar.expander("🎬 行情回放（加速重放历史）", expanded=False):
+    replay_enabled = st.checkbox("启用回放", value=False, help="从倒数第 N 根开始，把历史K线按倍速逐根送入指标/信号/图表，用于测试实时更新链路")
+    replay_speed = st.select_slider("倍速", options=SPEEDS, value=100, disabled=not replay_enabled)
+    replay_steps = st.number_input("每根K线拆分 tick 数（1 = 整根）", min_value=1, max_value=20, value=1, step=1,
+                                   disabled=not replay_enabled, help="大于 1 时按 O→高/低→C 的确定性路径合成K线内走势")
+    replay_from = st.number_input("从倒数第 N 根开始", min_value=1, max_value=max(1, len(df) - 1),
+                                  value=max(1, min(300, len(df) // 2)), step=10, disabled=not replay_enabled)
+    _rc1, _rc2, _rc3 = st.columns(3)
+    replay_toggle = _rc1.button("▶/⏸", use_container_width=True, disabled=not replay_enabled)
+    replay_step_once = _rc2.button("⏭", use_container_width=True, disabled=not replay_enabled)
+    replay_reset = _rc3.button("⏮", use_container_width=True, disabled=not replay_enabled)
+    st.markdown("**链路压测**（指标 + 信号，不渲染图表）")
+    replay_bench_unpaced = st.checkbox("不限速（测最大吞吐）", value=True)
+    replay_bench = st.button("⚡ 运行压测", use_container_width=True)
+
+df_full = df
+replay_state = None
+if replay_enabled:
+    replay_plan = ReplayPlan(len(df), len(df) - int(replay_from), int(replay_steps))
+    replay_bar_s = bar_seconds(df.index)
+    _rkey = (source, symbol, interval, len(df), str(df.index[-1]), replay_plan.start, replay_plan.steps)
+    replay_state = st.session_state.get("replay")
+    if replay_state is None or replay_state["key"] != _rkey or replay_reset:
+        replay_state = {"key": _rkey, "k": 0, "playing": False, "anchor": None, "stats": ReplayStats()}
+        st.session_state["replay"] = replay_state
+    _now = time.perf_counter()
+    if replay_toggle:
+        replay_state["playing"] = not replay_state["playing"]
+        replay_state["anchor"] = (_now, replay_state["k"], replay_speed)
+    if replay_step_once:
+        replay_state["playing"] = False
+        replay_state["k"] = min(replay_state["k"] + 1, replay_plan.total - 1)
+    if replay_state["playing"]:
+        if replay_state["anchor"][2] != replay_speed:  # 变速时以当前位置重新起算
+            replay_state["anchor"] = (_now, replay_state["k"], replay_speed)
+        _t0, _k0, _ = replay_state["anchor"]
+        _k = replay_plan.advance(_k0, _now - _t0, replay_speed, replay_bar_s)
+        replay_state["skipped"] = max(_k - replay_state["k"] - 1, 0)
+        replay_state["k"] = _k
+        if _k >= replay_plan.total - 1:
+            replay_state["playing"] = False
+    replay_state["t_frame"] = time.perf_counter()
+    df = frame_at(df_full, replay_plan, replay_state["k"])
+    df.attrs = {}  # 回放帧不是共享缓存中的原始数据，不能复用其指标缓存
 
 # ========================= Indicators =========================
 def parse_int_list(text):
@@ -353,8 +591,27 @@ def parse_int_list(text):
     except Exception:
         return []
 
+def parse_float_list(text):
+    try:
+        lst = [float(x.strip()) for x in text.split(",") if x.strip()]
+        return [x for x in lst if x > 0]
+    except Exception:
+        return []
+
+def parse_anchor_list(text):
+    anchors = []
+    for x in text.split(","):
+        try:
+            if x.strip():
+                anchors.append(pd.Timestamp(x.strip()))
+        except ValueError:
+            continue
+    return anchors
+
 def add_indicators(df):
+    mark = tracer.lap("add_indicators")
     out = df.copy()
+    mark("copy")
     close, high, low = out["Close"], out["High"], out["Low"]
     vol = out["Volume"] if "Volume" in out.columns else pd.Series(np.nan, index=out.index, name="Volume")
     if "Volume" not in out.columns: out["Volume"] = np.nan
@@ -366,56 +623,79 @@ def add_indicators(df):
     if use_ema:
         for p in parse_int_list(ema_periods_text):
             out[f"EMA{p}"] = close.ewm(span=p).mean()
+    mark("MA/EMA")
 
     # Bollinger
     if use_boll:
         boll = ta.volatility.BollingerBands(close=close, window=int(boll_window), window_dev=float(boll_std))
         out["BOLL_M"], out["BOLL_U"], out["BOLL_L"] = boll.bollinger_mavg(), boll.bollinger_hband(), boll.bollinger_lband()
+        mark("BOLL")
 
     # MACD
     if use_macd:
         macd_ind = ta.trend.MACD(close, window_slow=int(macd_slow), window_fast=int(macd_fast), window_sign=int(macd_sig))
         out["MACD"], out["MACD_signal"], out["MACD_hist"] = macd_ind.macd(), macd_ind.macd_signal(), macd_ind.macd_diff()
+        mark("MACD")
 
     # RSI
     if use_rsi: out["RSI"] = ta.momentum.RSIIndicator(close, window=int(rsi_window)).rsi()
+    mark("RSI")
 
     # ATR
     if use_atr: out["ATR"] = ta.volatility.AverageTrueRange(high, low, close, window=int(atr_window)).average_true_range()
+    mark("ATR")
 
     # ===== 新增指标 =====
     if use_vwap and "Volume" in out.columns and not out["Volume"].isnull().all():
-        typical_price = (high + low + close) / 3
-        vwap = (typical_price * vol).cumsum() / vol.cumsum()
+        # 按会话/周/月分段重置的 VWAP 及标准差带，锚定 VWAP 一次性广播计算
+        tp = typical_price(out)
+        seg = segment_ids(out.index, RESET_MODES[vwap_reset], SESSIONS[session_name])
+        vwap, vwap_std = segmented_vwap(tp, vol.to_numpy(dtype=float), seg)
         out["VWAP"] = vwap
+        for m in parse_float_list(vwap_bands_text):
+            out[f"VWAP_U{m:g}"] = vwap + m * vwap_std
+            out[f"VWAP_L{m:g}"] = vwap - m * vwap_std
+        anchors = parse_anchor_list(vwap_anchors_text)
+        pos = anchor_positions(out.index, anchors)
+        if pos:
+            avwap, _ = anchored_vwaps(tp, vol.to_numpy(dtype=float), pos)
+            for p, row in zip(sorted(set(pos)), avwap):
+                out[f"AVWAP_{out.index[p]:%Y-%m-%d %H:%M}"] = row
+        mark("VWAP")
 
     if use_adx:
         adx_ind = ta.trend.ADXIndicator(high=high, low=low, close=close, window=int(adx_window))
         out["ADX"] = adx_ind.adx()
         out["DIP"] = adx_ind.adx_pos()
         out["DIN"] = adx_ind.adx_neg()
+        mark("ADX")
 
     if use_stoch:
         stoch = ta.momentum.StochasticOscillator(high=high, low=low, close=close, window=int(stoch_k), smooth_window=int(stoch_smooth))
         out["STOCH_K"] = stoch.stoch()
         out["STOCH_D"] = stoch.stoch_signal() if hasattr(stoch, "stoch_signal") else out["STOCH_K"].rolling(int(stoch_d)).mean()
+        mark("Stochastic")
 
     if use_stochrsi:
         srsi = ta.momentum.StochRSIIndicator(close=close, window=int(stochrsi_window))
         out["StochRSI_K"] = srsi.stochrsi_k()
         out["StochRSI_D"] = srsi.stochrsi_d()
+        mark("StochRSI")
 
     if use_mfi and "Volume" in out.columns and not out["Volume"].isnull().all():
         mfi = ta.volume.MFIIndicator(high=high, low=low, close=close, volume=vol, window=int(mfi_window))
         out["MFI"] = mfi.money_flow_index()
+        mark("MFI")
 
     if use_cci:
         cci = ta.trend.CCIIndicator(high=high, low=low, close=close, window=int(cci_window))
         out["CCI"] = cci.cci()
+        mark("CCI")
 
     if use_obv and "Volume" in out.columns and not out["Volume"].isnull().all():
         obv = ta.volume.OnBalanceVolumeIndicator(close=close, volume=vol)
         out["OBV"] = obv.on_balance_volume()
+        mark("OBV")
 
     if use_psar:
         try:
@@ -423,6 +703,7 @@ def add_indicators(df):
             out["PSAR"] = ps.psar()
         except Exception:
             out["PSAR"] = np.nan
+        mark("PSAR")
 
     # ===== 新增KDJ指标 =====
     if use_kdj:
@@ -432,6 +713,7 @@ def add_indicators(df):
         out["KDJ_K"] = rsv.ewm(com=int(kdj_smooth_k)-1).mean()
         out["KDJ_D"] = out["KDJ_K"].ewm(com=int(kdj_smooth_d)-1).mean()
         out["KDJ_J"] = 3 * out["KDJ_K"] - 2 * out["KDJ_D"]
+        mark("KDJ")
 
     # ===== 新增：五个高级指标的计算 =====
 
@@ -443,6 +725,7 @@ def add_indicators(df):
         # 只有当当前点是窗口内的极值点时才记录
         out["SR_High"] = np.where(high == pivot_high, high, np.nan)
         out["SR_Low"] = np.where(low == pivot_low, low, np.nan)
+        mark("S/R")
 
     # 2. Machine Learning RSI
     if use_ml_rsi:
@@ -451,17 +734,14 @@ def add_indicators(df):
             rsi = rsi.ewm(span=ml_smooth_period).mean()
         out["ML_RSI"] = rsi
 
-        # 简化的聚类逻辑来确定动态阈值 (使用百分位数近似)
-        recent_rsi = rsi.dropna().tail(300)  # 取最近300个点
-        if len(recent_rsi) > 3:
-            # 用25%和75%分位数来模拟两个聚类中心
-            q25 = recent_rsi.quantile(0.25)
-            q75 = recent_rsi.quantile(0.75)
-            out["ML_RSI_Long_Threshold"] = q75  # 做多阈值
-            out["ML_RSI_Short_Threshold"] = q25 # 做空阈值
-        else:
-            out["ML_RSI_Long_Threshold"] = 70
-            out["ML_RSI_Short_Threshold"] = 30
+        # 逐K线滚动 k-means 动态阈值（只用截至当前K线的窗口数据，无未来函数）
+        long_th, mid_th, short_th = adaptive_thresholds(
+            rsi.to_numpy(), window=int(ml_window), k=int(ml_k), min_thresh=float(ml_min_thresh),
+            max_thresh=float(ml_max_thresh), step=float(ml_step), iters=int(ml_iters))
+        out["ML_RSI_Long_Threshold"] = long_th   # 做多阈值
+        out["ML_RSI_Mid"] = mid_th
+        out["ML_RSI_Short_Threshold"] = short_th # 做空阈值
+        mark("ML RSI")
 
     # 3. Normalised T3 Oscillator
     if use_norm_t3:
@@ -472,6 +752,7 @@ def add_indicators(df):
         highest_t3 = t3.rolling(window=norm_t3_period).max()
         norm_osc = (t3 - lowest_t3) / (highest_t3 - lowest_t3) - 0.5
         out["Norm_T3_Osc"] = norm_osc
+        mark("Norm T3")
 
     # 4. Parabolic RSI
     if use_parabolic_rsi:
@@ -525,6 +806,7 @@ def add_indicators(df):
             sar_rsi[i] = max(0, min(100, sar_rsi[i]))  # 限制在0-100
         out["Parabolic_RSI"] = sar_rsi
         out["Parabolic_RSI_Is_Below"] = is_below
+        mark("Parabolic RSI")
 
     # 5. Zero Lag Trend (MTF)
     if use_zlema_trend:
@@ -544,10 +826,120 @@ def add_indicators(df):
         trend[close < out["ZLEMA_Lower"]] = -1
         trend = trend.replace(0, method='ffill')  # 向后填充
         out["ZLEMA_Trend"] = trend
+        mark("ZLEMA Trend")
 
     return out
 
-dfi = add_indicators(df).dropna(how="all")
+def _indicator_params():
+    """add_indicators 直接读取的侧栏参数（简单类型的全局变量），用作共享指标缓存的键"""
+    g = globals()
+    return tuple((n, g[n]) for n in sorted(set(add_indicators.__code__.co_names))
+                 if isinstance(g.get(n), (bool, int, float, str)))
+
+# ========================= 渐进加载：先算最近 N 根，更早的历史在后台分块计算后追加到左侧 =========================
+with st.sidebar.expander("📜 渐进加载历史", expanded=False):
+    progressive = st.checkbox("启用渐进加载", value=True,
+                              help="先计算并渲染最近 N 根K线，更早的历史在后台按块计算（带预热K线），完成后追加到图表左侧；"
+                                   "EMA 类指标按有限预热，拼接处与整段计算近似一致（非逐位相同）。"
+                                   "预热K线数覆盖全部历史时（如默认 EMA200 配 1000 根K线）直接整段计算")
+    progressive_bars = st.number_input("首屏 / 每块K线数", min_value=100, max_value=5000, value=500, step=100, disabled=not progressive)
+    progressive_auto = st.checkbox("后台算完后自动追加", value=True, disabled=not progressive,
+                                   help="每次追加都会整页重跑并重建图表；关闭时点击下方按钮追加，图表缩放/平移状态在追加后保持不变")
+    progressive_auto_max = st.number_input("自动追加上限（块）", min_value=1, max_value=100, value=10, step=1,
+                                           disabled=not (progressive and progressive_auto),
+                                           help="自动追加达到上限后停止，更早的历史需手动追加")
+    progressive_more = st.button("⏪ 追加更早历史", use_container_width=True, disabled=not progressive)
+
+@st.cache_resource
+def get_history_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="history")
+
+def _warmup_bars():
+    """按已启用指标的回看长度估算预热K线数；EMA 按 6 倍跨度（残余权重约 e^-12）、Wilder 类按 10 倍窗口预热
+
+    预热有限，拼接处的 EMA/Wilder 类指标与整段计算只是近似一致，并非逐位相同。
+    """
+    w = [1]
+    if use_ma: w += parse_int_list(ma_periods_text)
+    if use_ema: w += [6 * p for p in parse_int_list(ema_periods_text)]
+    if use_boll: w.append(int(boll_window))
+    if use_macd: w.append(4 * int(macd_slow) + 4 * int(macd_sig))
+    if use_rsi: w.append(10 * int(rsi_window))
+    if use_atr: w.append(10 * int(atr_window))
+    if use_adx: w.append(20 * int(adx_window))
+    if use_stoch: w.append(int(stoch_k) + int(stoch_d) + int(stoch_smooth))
+    if use_stochrsi: w.append(10 * int(stochrsi_window) + int(stochrsi_window) + 6)
+    if use_mfi: w.append(int(mfi_window) + 1)
+    if use_cci: w.append(int(cci_window) * 2)
+    if use_kdj: w.append(int(kdj_window) + 10 * max(int(kdj_smooth_k), int(kdj_smooth_d)))
+    if use_sr: w.append(2 * int(sr_len) + 1)
+    if use_ml_rsi: w.append(10 * int(ml_rsi_length) + 4 * int(ml_smooth_period) + int(ml_window))
+    if use_norm_t3: w.append(int(norm_t3_period) + 24 * int(norm_t3_len))
+    if use_parabolic_rsi: w.append(10 * int(para_rsi_length) + 100)
+    if use_zlema_trend: w.append(10 * int(zlema_length) + 3 * int(zlema_length))
+    return max(w)
+
+def _indicator_window(index, lo, hi):
+    """计算 [lo, hi) 的指标需要的K线范围 [w0, w1)：向前预热，VWAP 回溯到所在分段起点和锚点，S/R 居中窗口向后多取"""
+    w0 = max(0, lo - _warmup_bars())
+    if use_obv:  # OBV 为自首根K线起的累计值，无法用有限预热还原
+        w0 = 0
+    if use_vwap:
+        reset = RESET_MODES[vwap_reset]
+        if reset is None:
+            w0 = 0
+        elif lo > 0:
+            seg = segment_ids(index[:lo + 1], reset, SESSIONS[session_name])
+            w0 = min(w0, int(np.flatnonzero(seg != seg[-1])[-1]) + 1 if (seg != seg[-1]).any() else 0)
+        pos = [p for p in anchor_positions(index, parse_anchor_list(vwap_anchors_text)) if p < hi]
+        if pos:
+            w0 = min(w0, min(pos))
+    w1 = min(len(index), hi + (int(sr_len) if use_sr else 0))
+    return w0, w1
+
+def indicators_range(df, lo, hi, shared=None):
+    """df.iloc[lo:hi] 的指标（带预热计算后裁剪）；共享缓存启用时按 (数据版本, 参数, 区间) 跨副本复用"""
+    w0, w1 = _indicator_window(df.index, lo, hi)
+    compute = lambda: add_indicators(df.iloc[w0:w1]).iloc[lo - w0:hi - w0].dropna(how="all")
+    if shared is not None and df.attrs.get("shared_version"):
+        return shared.get_or_load(("indicators", df.attrs["shared_version"], _indicator_params(), lo, hi), compute)
+    return compute()
+
+_shared = get_shared_cache()
+history = None
+# 首块的预热已回溯到第一根K线时，分块只会重复计算整段，直接整段计算
+_progressive_full = progressive and len(df) > progressive_bars and \
+    _indicator_window(df.index, len(df) - int(progressive_bars), len(df))[0] == 0
+if not progressive or len(df) <= progressive_bars or _progressive_full:
+    with tracer.span("add_indicators"):
+        dfi = indicators_range(df, 0, len(df), _shared)
+else:
+    _n, _chunk = len(df), int(progressive_bars)
+    _hkey = (source, symbol, interval, _n, str(df.index[0]), str(df.index[-1]), _indicator_params(), _chunk)
+    history = st.session_state.get("history")
+    if history is None or history["key"] != _hkey:
+        history = {"key": _hkey, "n": _n, "parts": [None],
+                   "lo": _n - _chunk, "pending": None, "pending_lo": None, "error": None, "auto": 0}
+        st.session_state["history"] = history
+    # 最新一块每次重跑都重算：未收盘K线（OKX 实时刷新、回放 tick）会原地更新最后一根，键中时间戳不变
+    with tracer.span("add_indicators"):
+        history["parts"][-1] = indicators_range(df, _n - _chunk, _n, _shared)
+    _fut = history["pending"]
+    _auto_ok = progressive_auto and history["auto"] < int(progressive_auto_max)
+    if _fut is not None and ((_fut.done() and _auto_ok) or progressive_more):
+        history["auto"] += 0 if progressive_more else 1
+        with tracer.span("history_append"):
+            try:
+                history["parts"].insert(0, _fut.result())
+                history["lo"] = history["pending_lo"]
+            except Exception as e:
+                history["error"] = str(e)
+            history["pending"] = None
+    # 始终在后台预取下一块，追加时无需等待
+    if history["pending"] is None and history["lo"] > 0 and history["error"] is None:
+        history["pending_lo"] = max(0, history["lo"] - _chunk)
+        history["pending"] = get_history_executor().submit(indicators_range, df, history["pending_lo"], history["lo"], _shared)
+    dfi = pd.concat(history["parts"]) if len(history["parts"]) > 1 else history["parts"][0]
 
 # ========================= 信号检测函数 =========================
 def detect_signals(df):
@@ -595,7 +987,8 @@ def detect_signals(df):
     return signals
 
 # 检测信号
-signals = detect_signals(dfi)
+with tracer.span("detect_signals"):
+    signals = detect_signals(dfi)
 
 # ========================= 支撑阻力计算 =========================
 def calculate_support_resistance(df, window=20):
@@ -610,11 +1003,13 @@ def calculate_support_resistance(df, window=20):
         support = recent_low
     return support, resistance
 
-support, resistance = calculate_support_resistance(dfi)
+with tracer.span("support_resistance"):
+    support, resistance = calculate_support_resistance(dfi)
 
 # ========================= TradingView 风格图表 =========================
 st.subheader(f"🕯️ K线（{symbol} / {source} / {interval}）")
 fig = go.Figure()
+fig_mark = tracer.lap("figure")
 
 # --- Build hovertext for candlestick ---
 try:
@@ -641,6 +1036,7 @@ try:
         dfi["hovertext"] = dfi["hovertext"] + "<br>Signal: " + dfi["Signal"].astype(str)
 except Exception as _e:
     dfi["hovertext"] = "Time: " + dfi.index.astype(str)
+fig_mark("hovertext")
 
 # --- 添加K线 ---
 fig.add_trace(
@@ -703,6 +1099,43 @@ if use_boll:
                 visible="legendonly"
             ))
 
+# VWAP（分段重置）/ 标准差带 / 锚定 VWAP
+if use_vwap and "VWAP" in dfi.columns:
+    fig.add_trace(go.Scatter(
+        x=dfi.index,
+        y=dfi["VWAP"],
+        mode="lines",
+        name=f"VWAP（{vwap_reset}）",
+        yaxis="y",
+        line=dict(color="#FFA15A", width=1.5),
+        visible="legendonly",
+        legendgroup="VWAP"
+    ))
+    for m in parse_float_list(vwap_bands_text):
+        for side in ["U", "L"]:
+            col = f"VWAP_{side}{m:g}"
+            if col in dfi.columns:
+                fig.add_trace(go.Scatter(
+                    x=dfi.index,
+                    y=dfi[col],
+                    mode="lines",
+                    name=f"VWAP {'+' if side == 'U' else '-'}{m:g}σ",
+                    yaxis="y",
+                    line=dict(color="#FFA15A", width=1, dash="dot"),
+                    visible="legendonly",
+                    legendgroup="VWAP"
+                ))
+    for col in [c for c in dfi.columns if c.startswith("AVWAP_")]:
+        fig.add_trace(go.Scatter(
+            x=dfi.index,
+            y=dfi[col],
+            mode="lines",
+            name=f"锚定VWAP {col[6:]}",
+            yaxis="y",
+            line=dict(color="#FF6692", width=1.5),
+            visible="legendonly"
+        ))
+
 # 支撑阻力
 fig.add_trace(go.Scatter(
     x=dfi.index,
@@ -893,14 +1326,21 @@ if use_ml_rsi and "ML_RSI" in dfi.columns:
         line=dict(color="#AB63FA"),
         visible="legendonly"
     ))
-    if "ML_RSI_Long_Threshold" in dfi.columns and not dfi["ML_RSI_Long_Threshold"].isna().all():
-        last_long_thresh = dfi["ML_RSI_Long_Threshold"].dropna().iloc[-1] if not dfi["ML_RSI_Long_Threshold"].dropna().empty else 70
-        fig.add_hline(y=last_long_thresh, line_dash="dot", line_color="#00CC96",
-                      annotation_text="Long", annotation_position="top right", yref="y6", visible="legendonly")
-    if "ML_RSI_Short_Threshold" in dfi.columns and not dfi["ML_RSI_Short_Threshold"].isna().all():
-        last_short_thresh = dfi["ML_RSI_Short_Threshold"].dropna().iloc[-1] if not dfi["ML_RSI_Short_Threshold"].dropna().empty else 30
-        fig.add_hline(y=last_short_thresh, line_dash="dot", line_color="#EF553B",
-                      annotation_text="Short", annotation_position="bottom right", yref="y6", visible="legendonly")
+    # 逐K线动态阈值
+    # k=3 时中间簇中心即中性区
+    for col, nm, color in [("ML_RSI_Long_Threshold", "ML RSI 做多阈值", "#00CC96"),
+                           ("ML_RSI_Short_Threshold", "ML RSI 做空阈值", "#EF553B")] + \
+            ([("ML_RSI_Mid", "ML RSI 中性区", "#B6B6B6")] if int(ml_k) == 3 else []):
+        if col in dfi.columns and not dfi[col].isna().all():
+            fig.add_trace(go.Scatter(
+                x=dfi.index,
+                y=dfi[col],
+                name=nm,
+                yaxis="y6",
+                mode="lines",
+                line=dict(color=color, dash="dot", shape="hv"),
+                visible="legendonly"
+            ))
     fig.add_hline(y=50, line_dash="solid", line_color="gray", yref="y6", opacity=0.3, visible="legendonly")
 
 # 4. Parabolic RSI (副图)
@@ -928,6 +1368,8 @@ if use_norm_t3 and "Norm_T3_Osc" in dfi.columns:
     ))
     fig.add_hline(y=0, line_dash="solid", line_color="white", yref="y7", opacity=0.5, visible="legendonly")
 
+fig_mark("traces")
+
 # --- 更新图表布局 ---
 fig.update_layout(
     hovermode='x unified',
@@ -957,41 +1399,335 @@ fig.update_layout(
     uirevision='constant'
 )
 
-# ===== 斐波那契回撤（默认隐藏，图例中点击开启；组点击=全显/全隐） =====
+# ===== 斐波那契回撤/扩展（默认隐藏，图例中点击开启；组点击=全显/全隐） =====
+# 拐点依赖整段历史（路径相关），不随渐进加载分块计算：按数据版本在全量K线上单次遍历，结果与指标一样缓存
+@st.cache_data(ttl=900, max_entries=64)
+def load_swings(_df, key, mode, threshold, atr_win):
+    mark_cache_miss()
+    return swing_pivots(_df, mode, threshold, atr_win)
+
 with st.sidebar.expander("⚙️ 斐波那契设置", expanded=False):
-    use_auto_fib = st.checkbox("自动高低点（最近N根K线）", value=True, key="auto_fib")
-    lookback = st.number_input("N（最近N根K线）", min_value=20, max_value=2000, value=100, step=10, key="fib_lookback")
-    if not use_auto_fib:
+    use_auto_fib = st.checkbox("自动识别波段（ZigZag）", value=True, key="auto_fib",
+                               help="单次遍历识别全部摆动高低点（反向运动超过阈值即确认拐点），在最近 K 个波段上绘制回撤/扩展位")
+    if use_auto_fib:
+        fib_mode = st.radio("拐点阈值", ["ATR 倍数", "百分比"], horizontal=True, key="fib_mode")
+        if fib_mode == "ATR 倍数":
+            fib_threshold = st.number_input(f"反向运动 ≥ ATR({int(atr_window)}) ×", min_value=0.5, value=3.0, step=0.5, key="fib_atr_mult")
+        else:
+            fib_threshold = st.number_input("反向运动 ≥ %", min_value=0.1, value=5.0, step=0.5, key="fib_pct")
+        fib_legs = st.number_input("显示最近 K 个波段", min_value=1, max_value=10, value=2, step=1, key="fib_legs")
+        fib_show_ext = st.checkbox("显示扩展位（127.2% / 161.8% / 261.8%）", value=True, key="fib_ext")
+    else:
         fib_high = st.number_input("自定义高点", min_value=0.0, value=float(dfi["High"].max()), key="fib_high")
         fib_low = st.number_input("自定义低点", min_value=0.0, value=float(dfi["Low"].min()), key="fib_low")
+
+    fib_x1 = dfi.index[-1]
+    if use_auto_fib:
+        _zmode = "atr" if fib_mode == "ATR 倍数" else "pct"
+        if _shared is not None and df_full.attrs.get("shared_version"):
+            pivots = _shared.get_or_load(("zigzag", df_full.attrs["shared_version"], _zmode, float(fib_threshold), int(atr_window)),
+                                         lambda: swing_pivots(df_full, _zmode, fib_threshold, int(atr_window)))
+        else:
+            _zkey = (source, symbol, interval, len(df_full), str(df_full.index[0]), str(df_full.index[-1]),
+                     float(df_full["High"].iat[-1]), float(df_full["Low"].iat[-1]))
+            pivots = tracer.cached_call("zigzag", load_swings, df_full, _zkey, _zmode, float(fib_threshold), int(atr_window),
+                                        parent="figure")
+        # 回放时只使用当前帧之前已确认的拐点（未走完的K线不参与确认），与实时看到的一致
+        _partial = replay_state is not None and replay_plan.locate(replay_state["k"])[1] < replay_plan.steps
+        fib_leg_list, fib_live = swing_legs(pivots, len(df) - int(_partial), df["High"].to_numpy(), df["Low"].to_numpy(),
+                                            k=int(fib_legs))
+        if fib_leg_list:
+            _act = fib_leg_list[-1]
+            _span = _act["end_price"] - _act["start_price"]
+            _retr = (_act["end_price"] - float(df["Close"].iat[-1])) / _span if _span else float("nan")
+            st.caption(f"共 {len(pivots)} 个拐点；最近波段 {'上行' if _act['direction'] == 1 else '下行'} "
+                       f"{_act['start_price']:,.4g} → {_act['end_price']:,.4g}（{df.index[_act['end']]}），"
+                       f"最新价位于其 {_retr * 100:.1f}% 回撤")
+        else:
+            st.caption("已确认的波段不足：降低阈值或加载更多历史")
+        fib_sets = []
+        for j, leg in enumerate(fib_leg_list):
+            # 每个波段的价位从波段起点画到下一波段结束（最近一个画到图表右端）
+            x1 = df.index[fib_leg_list[j + 1]["end"]] if j + 1 < len(fib_leg_list) else fib_x1
+            fib_sets.append((df.index[leg["start"]], x1, fib_levels(leg, extensions=EXTENSIONS if fib_show_ext else [])))
     else:
-        sub_df = dfi.tail(int(lookback))
-        fib_high = float(sub_df["High"].max())
-        fib_low = float(sub_df["Low"].min())
+        fib_leg_list, fib_live = [], None
+        fib_sets = [(dfi.index[0], fib_x1, fib_levels({"start_price": fib_low, "end_price": fib_high}, extensions=[]))]
 
-levels = [0, 0.236, 0.382, 0.5, 0.618, 0.786, 1]
+# 每个价位一条 trace（各波段用 None 断开），trace 数量与波段数无关
 first = True
-for lvl in levels:
-    price = fib_high - (fib_high - fib_low) * lvl
+for name in (fib_sets[0][2] if fib_sets else {}):
+    xs, ys = [], []
+    for x0, x1, lv in fib_sets:
+        xs += [x0, x1, None]
+        ys += [lv[name], lv[name], None]
     fig.add_trace(
         go.Scatter(
-            x=[dfi.index[0], dfi.index[-1]],
-            y=[price, price],
+            x=xs,
+            y=ys,
             mode="lines",
-            name=f"Fibonacci {lvl*100:.1f}%",
-            line=dict(dash="dot"),
+            name=f"Fibonacci {name}",
+            line=dict(dash="dot" if float(name[:-1]) <= 100 else "dash"),
             visible="legendonly",
             legendgroup="Fibonacci",
             showlegend=first,
-            legendgrouptitle_text="Fibonacci"
+            legendgrouptitle_text="Fibonacci",
+            connectgaps=False
         ),
         # 主图轴
     )
     first = False
+if use_auto_fib and (fib_leg_list or fib_live):
+    _zz = [(fib_leg_list[0]["start"], fib_leg_list[0]["start_price"])] if fib_leg_list else []
+    _zz += [(leg["end"], leg["end_price"]) for leg in fib_leg_list]
+    if fib_live is not None:
+        _zz = (_zz or [(fib_live["start"], fib_live["start_price"])]) + [(fib_live["end"], fib_live["end_price"])]
+    fig.add_trace(
+        go.Scatter(
+            x=[df.index[p] for p, _ in _zz],
+            y=[v for _, v in _zz],
+            mode="lines+markers",
+            name="ZigZag 波段（末段未确认）",
+            line=dict(width=1.5),
+            visible="legendonly",
+            legendgroup="Fibonacci",
+            showlegend=first,
+            legendgrouptitle_text="Fibonacci"
+        ),
+    )
+fig_mark("layout/fibonacci")
 
 # 显示图表
-st.plotly_chart(fig, use_container_width=True, config={
-    "scrollZoom": True,
-    "displayModeBar": True,
-    "displaylogo": False
-})
+with tracer.span("st.plotly_chart"):
+    st.plotly_chart(fig, use_container_width=True, config={
+        "scrollZoom": True,
+        "displayModeBar": True,
+        "displaylogo": False
+    })
+
+# ========================= 渐进加载状态与自动追加 =========================
+if _progressive_full:
+    st.caption(f"📜 首块指标的预热/累计区间已回溯到第一根K线（共 {len(df):,} 根），渐进加载无收益，已整段计算")
+if history is not None:
+    _pending = history["pending"]
+    _status = "；更早历史后台计算中…" if _pending is not None and not _pending.done() else \
+        ("；更早一块已就绪，点击“追加更早历史”加载" if _pending is not None else "；已全部加载")
+    st.caption(f"📜 已渲染最近 {len(df) - history['lo']:,}/{len(df):,} 根K线{_status}"
+               + (f"；后台计算失败：{history['error']}" if history["error"] else ""))
+    if _pending is not None and progressive_auto and history["auto"] < int(progressive_auto_max):
+        # 片段按秒检查后台任务，完成时触发整页重跑把新块拼到左侧（uirevision 保持当前缩放/平移）
+        @st.fragment(run_every=1.0)
+        def _history_ticker():
+            if history["pending"] is not None and history["pending"].done():
+                st.rerun(scope="app")
+        _history_ticker()
+
+# ========================= 回放状态与自动推进 =========================
+if replay_state is not None:
+    _rs = replay_state["stats"]
+    _bar_i, _tick = replay_plan.locate(replay_state["k"])
+    _rs.record(_bar_i, time.perf_counter() - replay_state["t_frame"], skipped=replay_state.pop("skipped", 0))
+    _sm = _rs.summary()
+    st.caption(
+        f"🎬 回放 {replay_speed}x ｜ 第 {_bar_i - replay_plan.start + 1}/{replay_plan.n_bars - replay_plan.start} 根"
+        + (f"（tick {_tick}/{replay_plan.steps}）" if replay_plan.steps > 1 else "")
+        + f" ｜ {df.index[-1]} ｜ {'播放中' if replay_state['playing'] else '已暂停'}"
+        + f" ｜ 指标→图表耗时 p50 {_sm['p50_ms']:.0f} ms / p95 {_sm['p95_ms']:.0f} ms"
+        + f" ｜ 因跟不上倍速跳过 {_sm['skipped_steps']} 步"
+    )
+    if replay_state["playing"]:
+        # 只在片段内按节拍检查，推进时触发整页重跑；页面不会因等待而阻塞
+        @st.fragment(run_every=max(replay_bar_s / replay_plan.steps / replay_speed, 0.2))
+        def _replay_ticker():
+            _t0, _k0, _sp = replay_state["anchor"]
+            if replay_plan.advance(_k0, time.perf_counter() - _t0, _sp, replay_bar_s) != replay_state["k"]:
+                st.rerun(scope="app")
+        _replay_ticker()
+
+# ========================= 跨资产相关性 / Beta / 相对强弱 =========================
+_ca_crypto = source not in ["Yahoo Finance（美股/A股）", "Finnhub API"]
+with st.sidebar.expander("🔗 跨资产分析", expanded=False):
+    use_cross_asset = st.checkbox("启用跨资产分析", value=False, help="多标的收盘价对齐后批量计算相关矩阵、相对基准的 Beta 与相对强弱排名")
+    ca_kind = st.selectbox("数据源", ["OKX 公共行情", "Yahoo Finance"], index=0 if _ca_crypto else 1, disabled=not use_cross_asset)
+    if ca_kind == "OKX 公共行情":
+        ca_default, ca_bench_default, ca_bars = "BTC-USDT,ETH-USDT,SOL-USDT,XRP-USDT,DOGE-USDT", "BTC-USDT", ["15m", "1H", "4H", "1D"]
+    else:
+        ca_default, ca_bench_default, ca_bars = "SPY,AAPL,TSLA,MSFT,NVDA,600519.SS,000001.SS", "SPY", ["1d", "1wk"]
+    ca_symbols_text = st.text_area("标的池（逗号或换行分隔，可填数百个）", value=ca_default, disabled=not use_cross_asset)
+    ca_benchmark = st.text_input("基准", value=ca_bench_default, disabled=not use_cross_asset)
+    ca_bar = st.selectbox("周期", ca_bars, index=len(ca_bars) - 1, disabled=not use_cross_asset)
+    ca_window = st.number_input("滚动窗口（根）", min_value=10, max_value=500, value=60, step=10, disabled=not use_cross_asset)
+    ca_lookbacks_text = st.text_input("相对强弱回看周期（逗号分隔）", value="20,60,120", disabled=not use_cross_asset)
+
+# refresh 与 load_cross_asset 的 key 一致：点击刷新时收盘价与截面结果一起重新计算
+@st.cache_data(ttl=900, show_spinner=False)
+def load_universe_closes(kind, symbols, bar, refresh):
+    mark_cache_miss()
+    if kind == "OKX 公共行情":
+        return fetch_okx_closes(OKX_PUBLIC_BASES[0], list(symbols), bar, limit=300)
+    return fetch_yf_closes(list(symbols), bar, period="2y")
+
+# 以 key（标的池 + 周期 + 刷新计数）区分缓存条目，_closes 不参与哈希
+@st.cache_data(ttl=900, max_entries=32, show_spinner=False)
+def load_cross_asset(_closes, key, benchmark, window, lookbacks):
+    mark_cache_miss()
+    return cross_asset_snapshot(_closes, benchmark, window, lookbacks)
+
+if use_cross_asset:
+    st.subheader(f"🔗 跨资产分析（基准 {ca_benchmark} / 窗口 {int(ca_window)} 根）")
+    _ca_symbols = tuple(dict.fromkeys([ca_benchmark.strip()] + [s.strip() for s in ca_symbols_text.replace("\n", ",").split(",") if s.strip()]))
+    _ca_lookbacks = tuple(parse_int_list(ca_lookbacks_text)) or (20,)
+    with tracer.span("cross_asset"), st.spinner(f"加载 {len(_ca_symbols)} 个标的…"):
+        _ca_closes = tracer.cached_call("universe", load_universe_closes, ca_kind, _ca_symbols, ca_bar,
+                                        st.session_state.refresh_counter, parent="cross_asset")
+        _ca_key = (ca_kind, _ca_symbols, ca_bar, st.session_state.refresh_counter)
+        ca = tracer.cached_call("cross_asset", load_cross_asset, _ca_closes, _ca_key, ca_benchmark.strip(), int(ca_window), _ca_lookbacks,
+                                parent="cross_asset")
+    if ca is None:
+        st.warning(f"基准 {ca_benchmark} 无数据或标的池为空（成功加载 {len(_ca_closes)}/{len(_ca_symbols)} 个标的）")
+    else:
+        _missing = [s for s in _ca_symbols if s not in ca["corr"].columns]
+        st.caption(f"对齐 {ca['corr'].shape[0]} 个标的、{len(ca['returns_index'])} 根K线"
+                   + (f"；{len(_missing)} 个标的无数据或覆盖不足已剔除：{', '.join(_missing[:20])}" if _missing else ""))
+        _tab_rs, _tab_corr, _tab_beta = st.tabs(["相对强弱排名", "相关性矩阵", "滚动 Beta"])
+        with _tab_rs:
+            st.dataframe(ca["table"].round(4), use_container_width=True)
+        with _tab_corr:
+            _n = ca["corr"].shape[0]
+            _hm = px.imshow(ca["corr"], zmin=-1, zmax=1, color_continuous_scale="RdBu_r", aspect="auto")
+            _hm.update_layout(height=min(max(400, 14 * _n), 1600))
+            st.plotly_chart(_hm, use_container_width=True)
+        with _tab_beta:
+            _beta_sel = st.multiselect("标的", list(ca["beta"].columns), default=[s for s in ca["table"].index[:5] if s != ca_benchmark.strip()])
+            if _beta_sel:
+                st.plotly_chart(px.line(ca["beta"][_beta_sel].dropna(how="all")), use_container_width=True)
+
+# ========================= ⑤ 风控参数：蒙特卡洛风险模拟 =========================
+# 以 key（数据版本）区分缓存条目，_returns 不参与哈希；侧栏参数变化时只重跑模拟本身
+@st.cache_data(ttl=900, max_entries=32, show_spinner=False)
+def run_risk_sim(_returns, key, stop_frac, exposure, params, bars_per_day, days, days_per_week, n_paths):
+    mark_cache_miss()
+    return simulate_paths(_returns, stop_frac, exposure, params, bars_per_day, days, days_per_week, n_paths)
+
+if use_risk_sim:
+    st.subheader("🎲 风控模拟（⑤ 风控参数）")
+    _risk_bar_s = bar_seconds(df.index)
+    _atr_now = dfi["ATR"].iloc[-1] if "ATR" in dfi.columns else \
+        ta.volatility.AverageTrueRange(dfi["High"], dfi["Low"], dfi["Close"], window=int(atr_window)).average_true_range().iloc[-1]
+    _price_now = float(dfi["Close"].iloc[-1])
+    if _risk_bar_s > 1.5 * 86400:
+        st.info("风险模拟按日/周亏损阈值逐日推进，需要日线或更短周期的数据。")
+    elif not (_atr_now > 0):
+        st.info("ATR 尚不可用（K线数量不足），无法计算止损距离。")
+    else:
+        risk_params = RiskParams(
+            account_value=float(account_value), risk_pct=float(risk_pct), leverage=float(leverage),
+            daily_loss_limit=float(daily_loss_limit), weekly_loss_limit=float(weekly_loss_limit),
+            atr_mult=float(risk_atr_mult), reward_risk=float(risk_rr),
+            direction=1 if risk_direction == "做多" else -1, ruin_pct=float(risk_ruin_pct),
+        )
+        sizing = position_size(_price_now, float(_atr_now), risk_params)
+        # 每日K线数、每周交易日数由数据本身推断（加密货币 24/7，股票按交易时段）
+        _dates = pd.Series(df.index.normalize())
+        _bars_per_day = float(_dates.value_counts().median())
+        _days_per_week = int(min(7, max(1, pd.Series(df.index.dayofweek).nunique())))
+        _rets = df["Close"].pct_change().to_numpy()[1:]  # 用全部已加载历史的收益分布，而非当前已渲染的部分
+        _risk_key = (source, symbol, interval, len(df), str(df.index[-1]), st.session_state.refresh_counter)
+        with tracer.span("risk_sim"):
+            _sim = tracer.cached_call("risk_sim", run_risk_sim, _rets, _risk_key, sizing["stop_frac"], sizing["exposure"],
+                                      risk_params, _bars_per_day, int(risk_days), _days_per_week, int(risk_paths),
+                                      parent="risk_sim")
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("建议名义仓位", f"{sizing['notional']:,.2f}", f"{sizing['units']:,.4f} 单位 / 保证金 {sizing['margin']:,.2f}", delta_color="off")
+        c2.metric("止损价（ATR×%g）" % risk_atr_mult, f"{sizing['stop_price']:,.4f}", f"距离 {sizing['stop_frac']*100:.2f}% / 风险 {sizing['risk_amount']:,.2f}", delta_color="off")
+        c3.metric("止盈价", f"{sizing['target_price']:,.4f}" if risk_rr > 0 else "—", f"约束：{sizing['binding']}", delta_color="off")
+        c4.metric("仓位 / 权益", f"{sizing['exposure']:.2f}x")
+        if _sim is None:
+            st.info("历史收益样本不足，无法模拟。")
+        else:
+            _st, _fan = _sim
+            if _st["horizon_bars"] > 2 * _st["history_bars"]:
+                st.warning(f"模拟期 {_st['horizon_bars']:,} 根K线是历史样本 {_st['history_bars']:,} 根的 "
+                           f"{_st['horizon_bars'] / _st['history_bars']:.1f} 倍，结果主要是对有限样本的重复抽样（样本内的漂移会被放大），"
+                           "请缩短模拟天数或加载更长历史后再参考。")
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("破产概率", f"{_st['risk_of_ruin']*100:.2f}%", f"权益跌破 {risk_ruin_pct:g}%", delta_color="off")
+            c2.metric("触及日亏损阈值", f"{_st['p_daily_limit']*100:.1f}%", f"平均每日 {_st['daily_limit_freq']*100:.1f}%", delta_color="off")
+            c3.metric("触及周亏损阈值", f"{_st['p_weekly_limit']*100:.1f}%", f"平均每周 {_st['weekly_limit_freq']*100:.1f}%", delta_color="off")
+            c4.metric("最大回撤（均值 / P95）", f"{_st['max_dd_mean']*100:.1f}%", f"P95 {_st['max_dd_p95']*100:.1f}%", delta_color="off")
+            if len(_fan["bars"]):
+                _q = _fan["quantiles"] * float(account_value)
+                _rf = go.Figure()
+                for (lo, hi), alpha in [((0, 4), 0.15), ((1, 3), 0.3)]:
+                    _rf.add_trace(go.Scatter(x=np.r_[_fan["bars"], _fan["bars"][::-1]], y=np.r_[_q[:, hi], _q[::-1, lo]],
+                                             fill="toself", fillcolor=f"rgba(31,119,180,{alpha})", line=dict(width=0),
+                                             name=f"P{[5, 25, 50, 75, 95][lo]}–P{[5, 25, 50, 75, 95][hi]}", hoverinfo="skip"))
+                _rf.add_trace(go.Scatter(x=_fan["bars"], y=_q[:, 2], mode="lines", name="中位数", line=dict(color="#1f77b4")))
+                _rf.add_hline(y=float(account_value) * risk_ruin_pct / 100, line_dash="dash", line_color="red", opacity=0.5)
+                _rf.update_layout(height=320, xaxis_title="K线数", yaxis_title="权益", margin=dict(t=20, b=40))
+                st.plotly_chart(_rf, use_container_width=True)
+            st.caption(f"{_st['paths']:,} 条路径 × {_st['steps']} 步（每步 {_st['bars_per_step']} 根K线，{_bars_per_day:g} 根/日，"
+                       f"{_days_per_week} 日/周）；期末权益 P5/P50/P95 = {_st['final_p5']*account_value:,.0f} / "
+                       f"{_st['final_p50']*account_value:,.0f} / {_st['final_p95']*account_value:,.0f}，"
+                       f"平均每条路径 {_st['trades_mean']:.1f} 笔，止损占比 {_st['stop_rate']*100:.0f}%")
+
+# ========================= 性能诊断面板 =========================
+if tracer.enabled:
+    registry = get_metrics_registry()
+    registry.observe(tracer)
+    with st.expander("⏱️ 本次重跑耗时", expanded=False):
+        spans_df = tracer.to_frame()
+        top = spans_df[spans_df["parent"] == ""]
+        st.caption(f"顶层阶段合计 {top['duration_ms'].sum():.1f} ms（{len(dfi)} 根K线）")
+        st.dataframe(spans_df.round(2), hide_index=True, use_container_width=True)
+        cache_df = tracer.cache_frame()
+        if not cache_df.empty:
+            st.markdown("**加载缓存命中**")
+            st.dataframe(cache_df, hide_index=True, use_container_width=True)
+    try:
+        if perf_log_path:
+            append_jsonl(perf_log_path, tracer.to_record(source=source, symbol=symbol, interval=interval, bars=len(dfi)))
+        if perf_prom_path:
+            write_atomic(perf_prom_path, registry.to_prometheus())
+    except OSError as e:
+        st.warning(f"性能数据导出失败：{e}")
+
+# ========================= 单次重跑剖析结果 =========================
+if profile_capture is not None:
+    st.session_state["profile_result"] = profile_capture.stop()
+    st.session_state.pop("_active_profile", None)
+if st.session_state.get("profile_result"):
+    _pr = st.session_state["profile_result"]
+    with st.expander(f"📸 剖析结果（{_pr['created']}，耗时 {_pr['wall_s']:.2f}s，内存峰值 {_pr['peak_mb']:.1f} MiB）", expanded=False):
+        c1, c2 = st.columns(2)
+        with c1:
+            st.download_button("下载 cProfile（.prof）", data=_pr["prof"], file_name=f"rerun-{_pr['created']}.prof",
+                               mime="application/octet-stream", disabled=not _pr["prof"], use_container_width=True)
+        with c2:
+            st.download_button("下载内存分配报告（.txt）", data=_pr["alloc_text"], file_name=f"rerun-{_pr['created']}-alloc.txt",
+                               mime="text/plain", use_container_width=True)
+        st.caption("可用 snakeviz / `python -m pstats` 打开 .prof 文件")
+        st.markdown("**累计耗时 Top（cProfile）**")
+        st.code(_pr["stats_text"], language="text")
+        st.markdown("**内存分配 Top（tracemalloc）**")
+        st.code(_pr["alloc_text"], language="text")
+
+# ========================= 回放压测：逐步重放整段历史，只跑指标与信号 =========================
+if replay_bench:
+    _plan = ReplayPlan(len(df_full), len(df_full) - int(replay_from), int(replay_steps))
+    _bar_s = bar_seconds(df_full.index)
+    _speed = 0 if replay_bench_unpaced else replay_speed
+    if _speed and _plan.total * _bar_s / _plan.steps / _speed > 300:
+        st.warning(f"按 {_speed}x 重放 {_plan.total} 步需要超过 5 分钟，已改为不限速运行。")
+        _speed = 0
+    _perf_tracer, tracer = tracer, Tracer(enabled=False)  # 压测期间不记录逐次分段耗时
+    with st.spinner(f"回放压测中（{_plan.total} 步）…"):
+        _bench = run_replay(df_full, _plan, lambda frame: detect_signals(add_indicators(frame)), speed=_speed, bar_s=_bar_s)
+    tracer = _perf_tracer
+    _sm = _bench.summary()
+    st.session_state["replay_bench"] = {"speed": _speed or "不限速", **_sm,
+                                        "sustainable_x": round(_bar_s / _plan.steps / max(_sm["p95_ms"] / 1000, 1e-6), 1)}
+if st.session_state.get("replay_bench"):
+    with st.expander("⚡ 回放压测结果（指标 + 信号链路）", expanded=True):
+        st.dataframe(pd.DataFrame([st.session_state["replay_bench"]]), hide_index=True, use_container_width=True)
+        st.caption("sustainable_x：按 p95 单步耗时估算，链路能不落后地跟上的最高倍速")
@@ -0,0 +1,120 @@
+# cross_asset.py — 跨资产相关性 / Beta / 相对强弱：多标的收盘价对齐到同一时间轴后，用二维数组的累计和与矩阵乘法批量计算
+import numpy as np
+import pandas as pd
+
+
+def align_returns(closes, min_coverage=0.5):
+    """{symbol: 收盘价 Series} → 对齐后的对数收益率 DataFrame（T×N）
+
+    每个标的先在自己的时间轴上求收益率再按时间外连接，缺失处保留 NaN（不做前向填充，
+    避免美股休市时段被当成 0 收益压低相关性）；覆盖率低于 min_coverage 的标的剔除。
+    """
+    rets = {}
+    for sym, s in closes.items():
+        s = pd.Series(s, dtype=float).dropna()
+        s = s[~s.index.duplicated(keep="last")].sort_index()
+        s = s[s > 0]
+        if len(s) > 2:
+            rets[sym] = np.log(s).diff().iloc[1:]
+    if not rets:
+        return pd.DataFrame()
+    df = pd.DataFrame(rets).sort_index()
+    keep = df.notna().mean() >= min_coverage
+    return df.loc[:, keep]
+
+
+def _rolling_sum(a, window):
+    """沿时间轴（axis=0）的滑动窗口和：一次 cumsum 后错位相减"""
+    cs = np.cumsum(a, axis=0)
+    out = cs.copy()
+    out[window:] = cs[window:] - cs[:-window]
+    return out
+
+
+def rolling_beta_corr(rets, bench, window, min_periods=None):
+    """所有标的相对基准的滚动 Beta 与相关系数，返回两个 T×N 数组
+
+    rets: T×N（可含 NaN），bench: 长度 T。每对 (标的, 基准) 只用两者都有值的K线，
+    五组滑动和（n, Σx, Σb, Σxb, Σx², Σb²）各做一次二维 cumsum 即得到全部结果。
+    """
+    x = np.asarray(rets, dtype=float)
+    b = np.asarray(bench, dtype=float)[:, None]
+    m = (~np.isnan(x) & ~np.isnan(b)).astype(float)
+    x0, b0 = np.where(m > 0, x, 0.0), np.where(m > 0, b, 0.0)
+    n = _rolling_sum(m, window)
+    sx, sb = _rolling_sum(x0, window), _rolling_sum(b0, window)
+    sxb, sxx, sbb = _rolling_sum(x0 * b0, window), _rolling_sum(x0 * x0, window), _rolling_sum(b0 * b0, window)
+    min_periods = max(3, window // 2) if min_periods is None else min_periods
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = n * sxb - sx * sb
+        var_x = n * sxx - sx * sx
+        var_b = n * sbb - sb * sb
+        beta = np.where((n >= min_periods) & (var_b > 0), cov / var_b, np.nan)
+        corr = np.where((n >= min_periods) & (var_b > 0) & (var_x > 0), cov / np.sqrt(var_x * var_b), np.nan)
+    return beta, np.clip(corr, -1.0, 1.0)
+
+
+def corr_matrix(rets, min_periods=3):
+    """成对完整（pairwise-complete）相关系数矩阵，N×N
+
+    以有效值掩码 M 与置零后的收益 X 做四次矩阵乘法：n=MᵀM，Σxy=XᵀX，Σx|y=XᵀM，Σx²|y=(X²)ᵀM，
+    与 pandas DataFrame.corr() 结果一致，但不需要逐对循环。
+    """
+    x = np.asarray(rets, dtype=float)
+    m = (~np.isnan(x)).astype(float)
+    x0 = np.where(m > 0, x, 0.0)
+    n = m.T @ m
+    sxy = x0.T @ x0
+    sx = x0.T @ m          # sx[i, j] = Σ x_i（在 j 也有值的K线上）
+    sxx = (x0 * x0).T @ m
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = n * sxy - sx * sx.T
+        var = n * sxx - sx * sx
+        c = cov / np.sqrt(var * var.T)
+    c = np.where(n >= min_periods, np.clip(c, -1.0, 1.0), np.nan)
+    np.fill_diagonal(c, np.where(np.diag(n) >= min_periods, 1.0, np.nan))
+    return c
+
+
+def relative_strength(rets, bench, lookbacks=(20, 60, 120)):
+    """各回看周期的累计收益、相对基准的超额收益及截面百分位排名，综合得分为各周期排名的均值"""
+    x = rets.to_numpy(dtype=float)
+    b = np.asarray(bench, dtype=float)
+    out = {}
+    ranks = []
+    for lb in lookbacks:
+        lb = min(lb, len(x))
+        tail = x[-lb:]
+        total = np.where(np.isnan(tail).all(axis=0), np.nan, np.nansum(tail, axis=0))
+        ret = np.expm1(total)
+        excess = ret - np.expm1(np.nansum(b[-lb:]))
+        out[f"ret_{lb}"] = ret
+        out[f"vs_bench_{lb}"] = excess
+        rank = pd.Series(excess).rank(pct=True).to_numpy()
+        out[f"rank_{lb}"] = rank
+        ranks.append(rank)
+    out["rs_score"] = np.nanmean(np.vstack(ranks), axis=0) * 100 if ranks else np.nan
+    return pd.DataFrame(out, index=rets.columns)
+
+
+def cross_asset_snapshot(closes, benchmark, window=60, lookbacks=(20, 60, 120), min_coverage=0.5):
+    """一次性计算截面结果：最近 window 根的相关矩阵、滚动 Beta/相关（全历史）与相对强弱表"""
+    rets = align_returns(closes, min_coverage)
+    if rets.empty or benchmark not in rets.columns:
+        return None
+    bench = rets[benchmark].to_numpy()
+    beta, corr_b = rolling_beta_corr(rets.to_numpy(), bench, window)
+    mat = corr_matrix(rets.iloc[-window:].to_numpy())
+    table = relative_strength(rets, bench, lookbacks)
+    table.insert(0, "beta", beta[-1])
+    table.insert(1, "corr_bench", corr_b[-1])
+    table.insert(2, "bars", rets.iloc[-window:].notna().sum().to_numpy())
+    table = table.sort_values("rs_score", ascending=False)
+    table["rs_rank"] = np.arange(1, len(table) + 1)
+    return {
+        "returns_index": rets.index,
+        "corr": pd.DataFrame(mat, index=rets.columns, columns=rets.columns),
+        "beta": pd.DataFrame(beta, index=rets.index, columns=rets.columns),
+        "corr_bench": pd.DataFrame(corr_b, index=rets.index, columns=rets.columns),
+        "table": table,
+    }
@@ -0,0 +1,139 @@
+# failover.py — 多数据源故障转移：对冲请求（hedged requests）+ 数据源健康评分
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class FailoverPolicy:
+    """故障转移策略
+
+    hedge_after: 首个请求超过该秒数仍未返回时，并发向下一个等价数据源发起对冲请求；
+                 设为 math.inf 即退化为“失败后才顺序回退”。
+    request_timeout: 单个数据源请求的超时（秒）。
+    total_timeout: 整体截止时间（秒），超过后放弃所有在途请求。
+    use_health: 是否按健康评分重排数据源尝试顺序。
+    """
+    hedge_after: float = 2.0
+    request_timeout: float = 15.0
+    total_timeout: float = 20.0
+    use_health: bool = True
+
+
+class ProviderHealth:
+    """按数据源记录成功率与延迟（指数加权），用于重排后续请求的尝试顺序"""
+
+    def __init__(self, alpha=0.3, default_latency=5.0):
+        self.alpha = alpha
+        self.default_latency = default_latency
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, ok, latency):
+        with self._lock:
+            st = self._stats.setdefault(name, {"success": 1.0, "latency": self.default_latency,
+                                               "ok": 0, "fail": 0, "last_error": ""})
+            a = self.alpha
+            st["success"] = (1 - a) * st["success"] + a * (1.0 if ok else 0.0)
+            if ok:
+                st["latency"] = (1 - a) * st["latency"] + a * latency
+                st["ok"] += 1
+            else:
+                st["fail"] += 1
+
+    def record_error(self, name, err):
+        with self._lock:
+            if name in self._stats:
+                self._stats[name]["last_error"] = str(err)[:200]
+
+    def score(self, name):
+        """健康分：成功率 / (1 + 平均延迟)，越高越优先"""
+        with self._lock:
+            st = self._stats.get(name)
+            if st is None:
+                return 1.0 / (1.0 + self.default_latency)
+            return st["success"] / (1.0 + st["latency"])
+
+    def order(self, names):
+        # 稳定排序：同分时保留调用方给出的默认优先级
+        return sorted(names, key=lambda n: -self.score(n))
+
+    def snapshot(self):
+        with self._lock:
+            rows = [dict(provider=k, score=v["success"] / (1.0 + v["latency"]), success_rate=v["success"],
+                         latency_s=v["latency"], ok=v["ok"], fail=v["fail"], last_error=v["last_error"])
+                    for k, v in self._stats.items()]
+        return pd.DataFrame(rows).sort_values("score", ascending=False) if rows else pd.DataFrame()
+
+
+def is_valid_ohlc(df):
+    return isinstance(df, pd.DataFrame) and not df.empty and {"Open", "High", "Low", "Close"}.issubset(df.columns)
+
+
+def hedged_fetch(providers, policy=None, health=None, validate=is_valid_ohlc):
+    """向等价数据源发起对冲请求，返回 (首个有效结果, 数据源名)；全部失败返回 (空 DataFrame, None)
+
+    providers: [(name, fn)]，fn(timeout, cancel_event) -> DataFrame。
+    - 先请求排名第一的数据源；超过 policy.hedge_after 秒未返回、或已失败时，立即启动下一个。
+    - 取第一个通过 validate 的结果，并对其余请求置取消标记（尚未开始的直接取消，
+      在途的 HTTP 请求无法中断，但其结果会被丢弃且不再解析）。
+    - 每个请求的成败与耗时记入 health，用于下次排序。
+    """
+    policy = policy or FailoverPolicy()
+    if not providers:
+        return pd.DataFrame(), None
+    fns = dict(providers)
+    names = [n for n, _ in providers]
+    if health is not None and policy.use_health:
+        names = health.order(names)
+
+    cancel = threading.Event()
+    deadline = time.monotonic() + policy.total_timeout
+    pool = ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="hedge")
+    pending = {}
+
+    def _run(name):
+        t0 = time.monotonic()
+        try:
+            res = fns[name](policy.request_timeout, cancel)
+            ok = validate(res)
+            if not cancel.is_set() or ok:
+                if health is not None:
+                    health.record(name, ok, time.monotonic() - t0)
+            return res if ok else None
+        except Exception as e:
+            if health is not None and not cancel.is_set():
+                health.record(name, False, time.monotonic() - t0)
+                health.record_error(name, e)
+            return None
+
+    queue = list(names)
+    try:
+        pending[pool.submit(_run, queue.pop(0))] = names[0]
+        next_launch = time.monotonic() + policy.hedge_after
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_for = deadline - now
+            if queue and math.isfinite(next_launch):
+                wait_for = min(wait_for, max(0.0, next_launch - now))
+            done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = pending.pop(fut)
+                res = fut.result()
+                if res is not None:
+                    return res, name
+            # 有请求失败或对冲计时到期 → 启动下一个数据源
+            if queue and (done or time.monotonic() >= next_launch or not pending):
+                nm = queue.pop(0)
+                pending[pool.submit(_run, nm)] = nm
+                next_launch = time.monotonic() + policy.hedge_after
+        return pd.DataFrame(), None
+    finally:
+        cancel.set()
+        pool.shutdown(wait=False, cancel_futures=True)
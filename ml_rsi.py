@@ -0,0 +1,131 @@
+# ml_rsi.py — ML RSI 自适应阈值：逐K线滚动 k-means（热启动），无未来函数
+import numpy as np
+
+
+def _lloyd_step(pc, ps, rows, cent, lo, resolution):
+    """对 rows 指定的各行（各根K线）同时做一次 Lloyd 迭代
+
+    pc/ps 为窗口内按桶的计数/取值前缀和，shape=(块长, 桶数+1)；按扁平下标只取 k+1 个边界。
+    """
+    width = pc.shape[1]
+    mids = (cent[:, :-1] + cent[:, 1:]) / 2.0
+    inner = np.clip(((mids - lo) / resolution).astype(np.int64) + 1, 0, width - 1)
+    edges = np.empty((len(rows), cent.shape[1] + 1), np.int64)
+    edges[:, 0], edges[:, 1:-1], edges[:, -1] = 0, inner, width - 1
+    flat = edges + (rows * width)[:, None]
+    cs, ss = pc.ravel()[flat], ps.ravel()[flat]
+    c = cs[:, 1:] - cs[:, :-1]
+    s = ss[:, 1:] - ss[:, :-1]
+    # 空簇保留上一根K线的质心
+    new = np.where(c > 0, s / np.where(c > 0, c, 1.0), cent)
+    new.sort(axis=1)
+    return new
+
+
+def _lloyd_scalar(pc_row, ps_row, cent, lo, resolution, iters):
+    """单根K线的标量版本，运算顺序与 _lloyd_step 一致"""
+    last = len(pc_row) - 1
+    k = len(cent)
+    for _ in range(iters):
+        edges = [0]
+        for j in range(k - 1):
+            edges.append(min(last, max(0, int(((cent[j] + cent[j + 1]) / 2.0 - lo) / resolution) + 1)))
+        edges.append(last)
+        new = []
+        for j in range(k):
+            c = pc_row[edges[j + 1]] - pc_row[edges[j]]
+            new.append((ps_row[edges[j + 1]] - ps_row[edges[j]]) / c if c > 0 else cent[j])
+        cent = sorted(new)
+    return cent
+
+
+def rolling_kmeans_1d(values, window=300, k=3, init=None, iters=2, resolution=0.5,
+                      lo=0.0, hi=100.0, min_count=None, chunk=4096):
+    """对一维序列做逐K线的滚动 k-means，返回 shape=(n, k) 的升序质心（预热期为 NaN）
+
+    第 t 根K线只使用 [t-window+1, t] 内的数据，并以第 t-1 根的质心为初值迭代 iters 次，
+    因此每根K线的更新代价与窗口长度无关，也不会引入未来数据。
+
+    实现：把取值离散到宽度为 resolution 的桶里，按块（chunk 根K线）用累计和一次性得到
+    每根K线的窗口直方图及桶内取值之和，再沿桶方向做前缀和；一维 k-means 的簇边界就是
+    相邻质心的中点，一次 Lloyd 迭代只需在前缀和上查 k+1 个位置。边界所在桶整体归入一侧，
+    误差不超过 resolution。
+    热启动的递推 c[t] = f(c[t-1]) 在块内用向量化的 Jacobi 扫描求解：每轮用上一轮的
+    c[t-1] 同时更新所有“前一根K线质心刚变化过”的行，直到不再变化——其不动点就是逐K线
+    顺序递推的结果；由于相邻窗口高度重叠，几轮后需要重算的行就只剩极少数，
+    此时改为按时间顺序逐行推进这几条仍在传播的链。
+    窗口直方图由累计和相减得到，与逐窗口直接统计的实现只在浮点误差内一致（约 1e-13，
+    比较时应使用 np.allclose 而非逐位相等）。
+    """
+    x = np.asarray(values, dtype=float)
+    n = len(x)
+    out = np.full((n, k), np.nan)
+    if n == 0:
+        return out
+    nbins = int(np.ceil((hi - lo) / resolution)) + 1
+    valid = np.isfinite(x)
+    xv = np.clip(np.where(valid, x, lo), lo, hi)
+    bins = ((xv - lo) / resolution).astype(np.int64)
+    min_count = min_count or max(2 * k, min(window, 30))
+
+    cent = np.sort(np.asarray(init, dtype=float)) if init is not None else np.linspace(lo, hi, k + 2)[1:-1]
+    for s in range(0, n, chunk):
+        e = min(n, s + chunk)
+        lo_row = max(0, s - window)
+        rows = np.arange(lo_row, e)
+        # 块内（含前置窗口）的 one-hot 计数与取值，按时间累计
+        cnt = np.zeros((len(rows) + 1, nbins))
+        tot = np.zeros((len(rows) + 1, nbins))
+        m = valid[rows]
+        cnt[np.flatnonzero(m) + 1, bins[rows][m]] = 1.0
+        tot[np.flatnonzero(m) + 1, bins[rows][m]] = x[rows][m]
+        np.cumsum(cnt, axis=0, out=cnt)
+        np.cumsum(tot, axis=0, out=tot)
+        t = np.arange(s, e)
+        a = t + 1 - lo_row
+        b = np.maximum(t + 1 - window, lo_row) - lo_row
+        # 窗口直方图 → 沿桶方向前缀和（第 j 列 = 桶号 < j 的累计）
+        pc = np.zeros((len(t), nbins + 1))
+        ps = np.zeros((len(t), nbins + 1))
+        np.cumsum(cnt[a] - cnt[b], axis=1, out=pc[:, 1:])
+        np.cumsum(tot[a] - tot[b], axis=1, out=ps[:, 1:])
+        ready = pc[:, -1] >= min_count
+
+        cur = np.tile(cent, (len(t), 1))
+        active = np.arange(len(t))
+        while active.size > 64:
+            # 只有上一轮中前一根K线质心发生变化的行才需要重算
+            prev = np.where((active > 0)[:, None], cur[active - 1], cent)
+            new = prev
+            for _ in range(iters):
+                new = _lloyd_step(pc, ps, active, new, lo, resolution)
+            new = np.where(ready[active][:, None], new, prev)
+            changed = active[(new != cur[active]).any(axis=1)]
+            cur[active] = new
+            active = changed[changed + 1 < len(t)] + 1
+        # 剩余少量仍在传播的链：按时间顺序逐行推进（Gauss-Seidel），直到不再变化
+        pending = sorted(active.tolist())
+        while pending:
+            i = pending.pop(0)
+            prev = (cur[i - 1] if i > 0 else cent).tolist()
+            new = _lloyd_scalar(pc[i], ps[i], prev, lo, resolution, iters) if ready[i] else prev
+            if new != cur[i].tolist():
+                cur[i] = new
+                if i + 1 < len(t) and (not pending or pending[0] != i + 1):
+                    pending.insert(0, i + 1)
+        out[t[ready]] = cur[ready]
+        cent = cur[-1]
+    return out
+
+
+def adaptive_thresholds(rsi, window=300, k=3, min_thresh=10, max_thresh=90, step=5, iters=2):
+    """由滚动 k-means 质心得到逐K线的 (做多阈值, 中性, 做空阈值)
+
+    质心以 [min_thresh, max_thresh] 等距初始化；阈值限制在该区间内并按 step 取整，
+    使侧栏的“聚类最小/最大阈值、步长”直接约束输出。k=2 时中性列为两阈值的中点。
+    """
+    cent = rolling_kmeans_1d(rsi, window=window, k=k, init=np.linspace(min_thresh, max_thresh, k), iters=iters)
+    snap = lambda v: np.clip(min_thresh + np.round((v - min_thresh) / step) * step, min_thresh, max_thresh)
+    long_th, short_th = snap(cent[:, -1]), snap(cent[:, 0])
+    mid = cent[:, 1] if k >= 3 else (cent[:, 0] + cent[:, -1]) / 2
+    return long_th, mid, short_th
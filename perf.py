@@ -0,0 +1,236 @@
+# perf.py — 重跑热路径耗时统计：分段计时、缓存命中统计、JSON 日志 / Prometheus 文本导出、单次重跑剖析
+import cProfile
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import pandas as pd
+
+_local = threading.local()
+
+
+class _NullSpan:
+    """关闭统计时返回的空上下文，不做任何计时"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _noop(*_args, **_kwargs):
+    return None
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "parent", "t0")
+
+    def __init__(self, tracer, name, parent):
+        self.tracer, self.name, self.parent = tracer, name, parent
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._record(self.name, self.parent, self.t0, time.perf_counter())
+        return False
+
+
+class Tracer:
+    """单次重跑的耗时记录器
+
+    enabled=False 时 span()/lap() 返回共享的空对象，开销只有一次方法调用。
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.t_start = time.perf_counter()
+        self.spans = []
+        self.cache = []
+
+    def span(self, name, parent=""):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, parent)
+
+    def lap(self, parent):
+        """返回 mark(name) 函数：每次调用记录自上一次 mark 以来的耗时，适合给长函数分段而不改缩进"""
+        if not self.enabled:
+            return _noop
+        last = [time.perf_counter()]
+
+        def mark(name):
+            now = time.perf_counter()
+            self._record(name, parent, last[0], now)
+            last[0] = now
+        return mark
+
+    def cached_call(self, name, fn, *args, parent="load_router", **kwargs):
+        """调用 st.cache_data 函数并记录命中/未命中（函数体内需调用 mark_cache_miss()）；parent 为所在的上层阶段"""
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        _local.miss = False
+        with self.span(f"load:{name}", parent=parent):
+            res = fn(*args, **kwargs)
+        self.cache.append({"loader": name, "hit": not getattr(_local, "miss", False)})
+        return res
+
+    def _record(self, name, parent, t0, t1):
+        self.spans.append({"stage": name, "parent": parent, "start_ms": (t0 - self.t_start) * 1000,
+                           "duration_ms": (t1 - t0) * 1000})
+
+    def to_frame(self):
+        return pd.DataFrame(self.spans, columns=["stage", "parent", "start_ms", "duration_ms"])
+
+    def cache_frame(self):
+        return pd.DataFrame(self.cache, columns=["loader", "hit"])
+
+    def to_record(self, **context):
+        return {"ts": time.time(), **context, "spans": self.spans, "cache": self.cache}
+
+
+def mark_cache_miss():
+    """在被缓存的加载函数体内调用：只有缓存未命中时函数体才会执行"""
+    _local.miss = True
+
+
+class MetricsRegistry:
+    """跨重跑累计的指标（进程级），用于导出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_seconds = {}
+        self.sum_seconds = defaultdict(float)
+        self.count = defaultdict(int)
+        self.cache_total = defaultdict(int)
+
+    def observe(self, tracer):
+        with self._lock:
+            for sp in tracer.spans:
+                key = (sp["stage"], sp["parent"])
+                sec = sp["duration_ms"] / 1000
+                self.last_seconds[key] = sec
+                self.sum_seconds[key] += sec
+                self.count[key] += 1
+            for c in tracer.cache:
+                self.cache_total[(c["loader"], "hit" if c["hit"] else "miss")] += 1
+
+    def to_prometheus(self, prefix="lqt"):
+        lines = [f"# HELP {prefix}_stage_seconds Duration of the last rerun stage.",
+                 f"# TYPE {prefix}_stage_seconds gauge"]
+        with self._lock:
+            for (stage, parent), v in sorted(self.last_seconds.items()):
+                lines.append(f'{prefix}_stage_seconds{{stage="{_esc(stage)}",parent="{_esc(parent)}"}} {v:.6f}')
+            lines += [f"# HELP {prefix}_stage_seconds_total Cumulative stage duration.",
+                      f"# TYPE {prefix}_stage_seconds_total counter"]
+            for (stage, parent), v in sorted(self.sum_seconds.items()):
+                lines.append(f'{prefix}_stage_seconds_total{{stage="{_esc(stage)}",parent="{_esc(parent)}"}} {v:.6f}')
+            lines += [f"# HELP {prefix}_stage_runs_total Number of observed stage runs.",
+                      f"# TYPE {prefix}_stage_runs_total counter"]
+            for (stage, parent), v in sorted(self.count.items()):
+                lines.append(f'{prefix}_stage_runs_total{{stage="{_esc(stage)}",parent="{_esc(parent)}"}} {v}')
+            lines += [f"# HELP {prefix}_cache_requests_total Loader cache lookups by result.",
+                      f"# TYPE {prefix}_cache_requests_total counter"]
+            for (loader, result), v in sorted(self.cache_total.items()):
+                lines.append(f'{prefix}_cache_requests_total{{loader="{_esc(loader)}",result="{result}"}} {v}')
+        return "\n".join(lines) + "\n"
+
+
+def _esc(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def append_jsonl(path, record):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def write_atomic(path, text):
+    """先写临时文件再 os.replace，避免采集端读到半个文件"""
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class ProfileCapture:
+    """对单次重跑做 cProfile + tracemalloc 采集
+
+    cProfile 只覆盖调用 start() 的线程（即脚本线程），对冲请求等后台线程不在其中。
+    """
+
+    def __init__(self, frames=25, top=40):
+        self.frames, self.top = frames, top
+        self.profile = None
+        self._own_tracemalloc = False
+        self.active = False
+
+    def start(self):
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError:  # 已有其他剖析器在运行
+            self.profile = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._own_tracemalloc = True
+        tracemalloc.reset_peak()
+        self.t0 = time.perf_counter()
+        self.active = True
+
+    def stop(self):
+        """停止采集，返回 {prof, stats_text, alloc_text, peak_mb, current_mb, wall_s}"""
+        if not self.active:
+            return None
+        self.active = False
+        wall = time.perf_counter() - self.t0
+        if self.profile is not None:
+            self.profile.disable()
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+
+        prof_bytes, stats_text = b"", "cProfile 未启用（已有其他剖析器在运行）"
+        if self.profile is not None:
+            fd, path = tempfile.mkstemp(suffix=".prof")
+            os.close(fd)
+            try:
+                self.profile.dump_stats(path)
+                with open(path, "rb") as f:
+                    prof_bytes = f.read()
+            finally:
+                os.remove(path)
+            buf = io.StringIO()
+            pstats.Stats(self.profile, stream=buf).strip_dirs().sort_stats("cumulative").print_stats(self.top)
+            stats_text = buf.getvalue()
+
+        alloc_text = ""
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ])
+            lines = [f"峰值 {peak / 2**20:.1f} MiB，当前 {current / 2**20:.1f} MiB，耗时 {wall:.2f}s", "",
+                     f"按代码行统计的 Top {self.top} 分配："]
+            for i, stat in enumerate(snapshot.statistics("lineno")[:self.top], 1):
+                fr = stat.traceback[0]
+                lines.append(f"#{i:<3} {stat.size / 1024:10.1f} KiB  {stat.count:8d} 块  {fr.filename}:{fr.lineno}")
+            alloc_text = "\n".join(lines) + "\n"
+        return {"prof": prof_bytes, "stats_text": stats_text, "alloc_text": alloc_text,
+                "peak_mb": peak / 2**20, "current_mb": current / 2**20, "wall_s": wall,
+                "created": time.strftime("%Y%m%d-%H%M%S")}
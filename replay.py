@@ -0,0 +1,182 @@
+# replay.py — 确定性行情回放：把已加载的历史K线逐根（或拆成 tick）按 1x–1000x 倍速重放，统计每步链路耗时与吞吐
+#
+# 用法（命令行，回放进后台告警评估器的增量指标状态）：
+#   python replay.py --source okx --symbol BTC-USDT --interval 15m --speed 1000
+#   python replay.py --source yf --symbol AAPL --interval 1d --speed 0      # 0 = 不限速，测最大吞吐
+import argparse
+import math
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+SPEEDS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+def bar_seconds(index):
+    """K线周期（秒），取相邻时间差的中位数，兼容所有数据源的周期写法"""
+    if len(index) < 2:
+        return 60.0
+    d = np.diff(pd.DatetimeIndex(index).as_unit("ns").asi8)
+    return float(np.median(d)) / 1e9
+
+
+def partial_bar(o, h, l, c, v, frac):
+    """按 O→先到的极值→另一极值→C 的确定性路径合成K线内 frac∈(0,1] 时刻的部分K线
+
+    阳线先探低点再冲高点，阴线反之；frac=1 时与原K线完全一致。
+    """
+    first, second = (l, h) if c >= o else (h, l)
+    t = min(max(frac, 0.0), 1.0) * 3
+    path = [o, first, second, c]
+    seg = min(int(t), 2)
+    last = path[seg] + (path[seg + 1] - path[seg]) * (t - seg)
+    seen = path[:seg + 1] + [last]
+    vol = v * frac if v is not None and not (isinstance(v, float) and math.isnan(v)) else v
+    return o, max(seen), min(seen), last, vol
+
+
+@dataclass
+class ReplayPlan:
+    """回放计划：前 start 根作为已知历史，之后每根拆成 steps 个 tick 依次送出；第 k 步完全由 k 决定"""
+    n_bars: int
+    start: int
+    steps: int = 1
+
+    @property
+    def total(self):
+        return max(self.n_bars - self.start, 0) * self.steps
+
+    def locate(self, k):
+        """第 k 步（从 0 开始）→ (K线下标, 该K线内第几个 tick，1..steps)"""
+        k = min(max(k, 0), self.total - 1)
+        return self.start + k // self.steps, k % self.steps + 1
+
+    def advance(self, anchor_k, elapsed_s, speed, bar_s):
+        """从 anchor_k 开始经过 elapsed_s 秒真实时间后应处于的步号（到末尾为止）"""
+        step_s = bar_s / self.steps
+        return min(anchor_k + int(elapsed_s * speed / step_s), self.total - 1)
+
+
+def frame_at(df, plan, k):
+    """第 k 步时“看得到”的K线：之前的完整K线 + 当前（可能未走完的）K线"""
+    i, tick = plan.locate(k)
+    if tick == plan.steps:
+        return df.iloc[:i + 1]
+    out = df.iloc[:i + 1].copy()
+    row = out.iloc[-1]
+    o, h, l, c, v = partial_bar(row["Open"], row["High"], row["Low"], row["Close"],
+                                row["Volume"] if "Volume" in out.columns else None, tick / plan.steps)
+    pos = [out.columns.get_loc(col) for col in ["Open", "High", "Low", "Close"]]
+    out.iloc[-1, pos] = [o, h, l, c]
+    if "Volume" in out.columns:
+        out.iloc[-1, out.columns.get_loc("Volume")] = v
+    return out
+
+
+@dataclass
+class ReplayStats:
+    """逐步记录链路耗时（latency）与相对计划时刻的滞后（lag）"""
+    latency_ms: list = field(default_factory=list)
+    lag_ms: list = field(default_factory=list)
+    bars: list = field(default_factory=list)
+    skipped: int = 0
+    t_first: float = None
+    t_last: float = None
+
+    def record(self, bar, latency_s, lag_s=0.0, skipped=0, now=None):
+        now = time.perf_counter() if now is None else now
+        self.t_first = now - latency_s if self.t_first is None else self.t_first
+        self.t_last = now
+        self.bars.append(bar)
+        self.latency_ms.append(latency_s * 1000)
+        self.lag_ms.append(lag_s * 1000)
+        self.skipped += skipped
+
+    def summary(self):
+        if not self.latency_ms:
+            return {}
+        lat = np.asarray(self.latency_ms)
+        wall = max(self.t_last - self.t_first, 1e-9)
+        n_bars = len(set(self.bars))
+        return {
+            "steps": len(lat), "bars": n_bars, "wall_s": round(wall, 3),
+            "steps_per_s": round(len(lat) / wall, 1), "bars_per_s": round(n_bars / wall, 1),
+            "p50_ms": round(float(np.percentile(lat, 50)), 2), "p95_ms": round(float(np.percentile(lat, 95)), 2),
+            "p99_ms": round(float(np.percentile(lat, 99)), 2), "max_ms": round(float(lat.max()), 2),
+            "max_lag_ms": round(max(self.lag_ms), 2), "skipped_steps": self.skipped,
+        }
+
+    def to_frame(self):
+        return pd.DataFrame({"bar": self.bars, "latency_ms": self.latency_ms, "lag_ms": self.lag_ms})
+
+
+def run_replay(df, plan, pipeline, speed=0, bar_s=None, max_steps=None,
+               clock=time.perf_counter, sleep=time.sleep, frames=True):
+    """逐步把回放帧送入 pipeline 并计时
+
+    speed>0 时按“每步真实间隔 = K线周期 / steps / speed”定时发出，pipeline 跟不上时不丢步，
+    只记录滞后；speed=0 不限速，用于测最大吞吐（压测）。
+    frames=False 时只把当前K线行（已合成的部分K线）传给 pipeline，适合增量计算。
+    """
+    bar_s = bar_seconds(df.index) if bar_s is None else bar_s
+    dt = bar_s / plan.steps / speed if speed else 0.0
+    n = plan.total if max_steps is None else min(plan.total, max_steps)
+    stats = ReplayStats()
+    t0 = clock()
+    for k in range(n):
+        due = t0 + k * dt
+        now = clock()
+        if now < due:
+            sleep(due - now)
+            now = clock()
+        if frames:
+            item = frame_at(df, plan, k)
+        else:
+            i, tick = plan.locate(k)
+            row = df.iloc[i]
+            item = (df.index[i], tick == plan.steps) + partial_bar(
+                row["Open"], row["High"], row["Low"], row["Close"], row.get("Volume"), tick / plan.steps)
+        pipeline(item)
+        end = clock()
+        stats.record(plan.locate(k)[0], end - now, max(now - due, 0.0) if dt else 0.0, now=end)
+    return stats
+
+
+def main(argv=None):
+    from alerts import SymbolState, fetch_recent
+
+    ap = argparse.ArgumentParser(description="把历史K线回放进告警评估器的增量指标状态，测量每根K线的处理耗时")
+    ap.add_argument("--source", default="okx", choices=["okx", "yf"])
+    ap.add_argument("--symbol", default="BTC-USDT")
+    ap.add_argument("--interval", default="15m")
+    ap.add_argument("--limit", type=int, default=300, help="拉取的历史K线数量（okx）")
+    ap.add_argument("--warmup", type=int, default=100, help="不计入统计的预热K线数")
+    ap.add_argument("--steps", type=int, default=1, help="每根K线拆分的 tick 数")
+    ap.add_argument("--speed", type=float, default=1000, help="倍速，0 表示不限速")
+    args = ap.parse_args(argv)
+
+    df = fetch_recent(args.source, args.symbol, args.interval, args.limit)
+    if df.empty:
+        raise SystemExit("没有拉取到K线")
+    state = SymbolState()
+    for ts, row in df.iloc[:args.warmup].iterrows():
+        state.update(ts, row["Open"], row["High"], row["Low"], row["Close"], row.get("Volume"))
+    fired = []
+
+    def pipeline(item):
+        ts, closed, o, h, l, c, v = item
+        if closed:  # 增量状态只接收已收盘K线；未走完的 tick 只计入耗时统计
+            events, _ = state.update(ts, o, h, l, c, v)
+            fired.extend(events)
+
+    plan = ReplayPlan(len(df), min(args.warmup, len(df) - 1), args.steps)
+    stats = run_replay(df, plan, pipeline, speed=args.speed, frames=False)
+    for k, v in stats.summary().items():
+        print(f"{k:>14}: {v}")
+    print(f"{'signals':>14}: {len(fired)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# resample.py — 由基础周期K线本地聚合更高周期（向量化 reduceat），支持交易时段与缺口检测
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+_MIN_NS = 60 * 10**9
+
+# 各数据源周期写法 → (单位, 数量)；单位: "min" 固定分钟数, "W" 周, "M" 自然月
+_INTERVAL_ALIASES = {
+    "1d": ("min", 1440), "1D": ("min", 1440), "D": ("min", 1440),
+    "1w": ("W", 1), "1wk": ("W", 1), "1W": ("W", 1), "W": ("W", 1),
+    "1M": ("M", 1), "1mo": ("M", 1), "M": ("M", 1),
+}
+
+
+@dataclass(frozen=True)
+class Session:
+    """交易时段：tz 为交易所时区，segments 为当日交易时间段 [("09:30","11:30"), ...]"""
+    name: str
+    tz: str
+    segments: tuple
+
+    @property
+    def segment_minutes(self):
+        return [(_hm(a), _hm(b)) for a, b in self.segments]
+
+
+SESSIONS = {
+    "24/7（加密货币）": None,
+    "美股 09:30-16:00 (America/New_York)": Session("US", "America/New_York", (("09:30", "16:00"),)),
+    "A股 09:30-11:30,13:00-15:00 (Asia/Shanghai)": Session("CN", "Asia/Shanghai", (("09:30", "11:30"), ("13:00", "15:00"))),
+    "港股 09:30-12:00,13:00-16:00 (Asia/Hong_Kong)": Session("HK", "Asia/Hong_Kong", (("09:30", "12:00"), ("13:00", "16:00"))),
+}
+
+
+def _hm(text):
+    h, m = text.split(":")
+    return int(h) * 60 + int(m)
+
+
+def parse_interval(interval):
+    """把 '15m'/'4H'/'60'/'1d'/'1wk'/'1M' 等写法统一为 (单位, 数量)；无法识别返回 None"""
+    if interval in _INTERVAL_ALIASES:
+        return _INTERVAL_ALIASES[interval]
+    if re.fullmatch(r"\d+", interval):  # Finnhub: 纯数字=分钟
+        return ("min", int(interval))
+    m = re.fullmatch(r"(\d+)([mHhD])", interval)
+    if not m:
+        return None
+    n, unit = int(m.group(1)), m.group(2)
+    return ("min", n * {"m": 1, "H": 60, "h": 60, "D": 1440}[unit])
+
+
+def interval_minutes(interval):
+    """近似分钟数，仅用于比较周期粗细"""
+    p = parse_interval(interval)
+    if p is None:
+        return None
+    unit, n = p
+    return n * {"min": 1, "W": 7 * 1440, "M": 30 * 1440}[unit]
+
+
+def can_derive(base_interval, target_interval):
+    """target 能否由 base 聚合得到（整数倍，且周/月只能由日线及以下聚合）"""
+    b, t = parse_interval(base_interval), parse_interval(target_interval)
+    if b is None or t is None or b[0] != "min":
+        return b is not None and t is not None and b == t
+    if t[0] == "min":
+        return t[1] >= b[1] and t[1] % b[1] == 0
+    return 1440 % b[1] == 0
+
+
+def _to_local(index, session):
+    idx = pd.DatetimeIndex(index).as_unit("ns")
+    if session is None:
+        return idx.tz_convert("UTC").tz_localize(None) if idx.tz is not None else idx
+    if idx.tz is None:
+        # 无时区且全部落在零点的日线（如 yfinance 日线）本身就是交易所本地日期
+        if len(idx) and not (idx.asi8 % (1440 * _MIN_NS)).any():
+            return idx
+        idx = idx.tz_localize("UTC")
+    return idx.tz_convert(session.tz).tz_localize(None)
+
+
+def _session_offsets(local, session):
+    """返回 (交易日序号, 当日已交易分钟数, 是否在交易时段内)"""
+    ns = local.asi8
+    day = ns // (1440 * _MIN_NS)
+    minute = (ns // _MIN_NS) - day * 1440
+    offset = np.full(len(ns), -1, dtype=np.int64)
+    elapsed = 0
+    for start, end in session.segment_minutes:
+        inside = (minute >= start) & (minute < end)
+        offset[inside] = elapsed + (minute[inside] - start)
+        elapsed += end - start
+    return day, offset, offset >= 0
+
+
+def bucket_keys(index, target_interval, session=None):
+    """为每根基础K线计算目标周期的桶编号（单调不减），以及桶起始时间与有效掩码"""
+    unit, n = parse_interval(target_interval)
+    local = _to_local(index, session)
+    ns = local.asi8
+    valid = np.ones(len(ns), dtype=bool)
+    if unit == "M":
+        months = local.year.to_numpy() * 12 + (local.month.to_numpy() - 1)
+        keys = months // n
+        starts = pd.to_datetime({"year": keys * n // 12, "month": keys * n % 12 + 1, "day": 1}).to_numpy()
+    elif unit == "W":
+        days = ns // (1440 * _MIN_NS)
+        keys = (days + 3) // (7 * n)  # 1970-01-01 为周四，+3 使周一对齐
+        starts = ((keys * 7 * n - 3) * 1440 * _MIN_NS).astype("datetime64[ns]")
+    elif session is not None and n < 1440:
+        day, offset, valid = _session_offsets(local, session)
+        keys = day * 10**6 + np.where(valid, offset // n, 0)
+        first = np.asarray([s for s, _ in session.segment_minutes])
+        # 桶起点 = 交易日 + 对应交易分钟所在的真实时刻
+        seg_len = np.asarray([e - s for s, e in session.segment_minutes])
+        seg_cum = np.concatenate([[0], np.cumsum(seg_len)[:-1]])
+        bstart = np.where(valid, offset // n * n, 0)
+        seg_idx = np.clip(np.searchsorted(seg_cum, bstart, side="right") - 1, 0, len(first) - 1)
+        start_min = first[seg_idx] + (bstart - seg_cum[seg_idx])
+        starts = ((day * 1440 + start_min) * _MIN_NS).astype("datetime64[ns]")
+    else:
+        step = n * _MIN_NS
+        keys = ns // step
+        starts = (keys * step).astype("datetime64[ns]")
+    return np.asarray(keys), np.asarray(starts, dtype="datetime64[ns]"), valid
+
+
+def resample_ohlcv(df, target_interval, session=None):
+    """把基础周期 OHLC(V) 聚合为 target_interval
+
+    - 单次排序后以 np.*.reduceat 做分组归约，避免 groupby/resample 的逐组开销；
+    - 输出包含 Volume 与 PV（典型价×量之和）及 VWAP，可继续向更高周期叠加聚合；
+    - Bars 列为每个桶实际包含的基础K线数，可用来识别不完整的桶；
+    - session 不为空时，只保留交易时段内的K线，日内桶从每日开盘起按交易分钟切分。
+    """
+    if df.empty:
+        return df.copy()
+    df = df.sort_index()
+    keys, starts, valid = bucket_keys(df.index, target_interval, session)
+    if not valid.all():
+        df, keys, starts = df[valid], keys[valid], starts[valid]
+        if df.empty:
+            return df.copy()
+    cut = np.flatnonzero(np.diff(keys)) + 1
+    first = np.concatenate([[0], cut])
+    last = np.concatenate([cut, [len(keys)]]) - 1
+
+    high = df["High"].to_numpy(dtype=float)
+    low = df["Low"].to_numpy(dtype=float)
+    close = df["Close"].to_numpy(dtype=float)
+    out = {
+        "Open": df["Open"].to_numpy(dtype=float)[first],
+        "High": np.maximum.reduceat(high, first),
+        "Low": np.minimum.reduceat(low, first),
+        "Close": close[last],
+    }
+    if "Volume" in df.columns:
+        vol = np.nan_to_num(df["Volume"].to_numpy(dtype=float))
+        pv = (df["PV"].to_numpy(dtype=float) if "PV" in df.columns
+              else (high + low + close) / 3 * vol)
+        out["Volume"] = np.add.reduceat(vol, first)
+        out["PV"] = np.add.reduceat(np.nan_to_num(pv), first)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out["VWAP"] = np.where(out["Volume"] > 0, out["PV"] / out["Volume"], np.nan)
+    bars = df["Bars"].to_numpy() if "Bars" in df.columns else np.ones(len(df), dtype=np.int64)
+    out["Bars"] = np.add.reduceat(bars, first)
+
+    index = pd.DatetimeIndex(starts[first], name=df.index.name or "Date")
+    if session is not None:
+        index = index.tz_localize(session.tz)
+    return pd.DataFrame(out, index=index)
+
+
+def detect_gaps(index, base_interval, session=None):
+    """检测基础序列中的缺口，返回 DataFrame[gap_start, gap_end, missing_bars]
+
+    session 不为空时只统计交易时段内的缺口（午休、收盘后与跨日不算缺口）。
+    周/月线不做缺口检测。
+    """
+    cols = ["gap_start", "gap_end", "missing_bars"]
+    p = parse_interval(base_interval)
+    if p is None or p[0] != "min" or len(index) < 2:
+        return pd.DataFrame(columns=cols)
+    n = p[1]
+    local = _to_local(pd.DatetimeIndex(index).sort_values(), session)
+    if session is not None and n < 1440:
+        day, offset, valid = _session_offsets(local, session)
+        day, offset, local = day[valid], offset[valid], local[valid]
+        same_day = day[1:] == day[:-1]
+        missing = np.where(same_day, (offset[1:] - offset[:-1]) // n - 1, 0)
+    else:
+        step = n * _MIN_NS
+        missing = np.diff(local.asi8) // step - 1
+        if session is not None:
+            # 日线：周末不算缺口，只统计工作日缺失
+            d = local.asi8 // (1440 * _MIN_NS)
+            missing = np.maximum(np.busday_count(d[:-1].astype("datetime64[D]") + 1,
+                                                 d[1:].astype("datetime64[D]")), 0)
+    at = np.flatnonzero(missing > 0)
+    return pd.DataFrame({"gap_start": local[at], "gap_end": local[at + 1],
+                         "missing_bars": missing[at].astype(int)}, columns=cols)
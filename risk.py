@@ -0,0 +1,165 @@
+# risk.py — 风控参数的蒙特卡洛模拟：ATR 止损定仓，按历史收益分布块自助抽样，批量模拟上万条资金曲线
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class RiskParams:
+    account_value: float = 1000.0
+    risk_pct: float = 0.5            # 单笔风险（占当前权益 %）
+    leverage: float = 1.0            # 名义仓位上限 = 权益 × 杠杆
+    daily_loss_limit: float = 2.0    # 当日亏损达到该比例（%）即停止交易至次日
+    weekly_loss_limit: float = 5.0   # 当周亏损达到该比例（%）即停止交易至下周
+    atr_mult: float = 2.0            # 止损距离 = atr_mult × ATR
+    reward_risk: float = 2.0         # 止盈距离 = reward_risk × 止损距离（0 表示不设止盈）
+    direction: int = 1               # 1 做多，-1 做空
+    ruin_pct: float = 50.0           # 权益跌破初始资金的该比例（%）视为破产
+
+
+def position_size(price, atr, p):
+    """按 ATR 止损计算建议仓位：风险金额 / 止损距离，受杠杆上限与单日亏损阈值约束"""
+    stop_frac = p.atr_mult * atr / price
+    risk_amount = p.account_value * p.risk_pct / 100
+    notional_risk = risk_amount / stop_frac
+    notional_cap = p.account_value * p.leverage
+    # 一次止损（按止损价成交）不应超过单日亏损阈值
+    notional_daily = p.account_value * p.daily_loss_limit / 100 / stop_frac
+    notional = min(notional_risk, notional_cap, notional_daily)
+    binding = ["单笔风险", "杠杆上限", "单日亏损阈值"][int(np.argmin([notional_risk, notional_cap, notional_daily]))]
+    return {
+        "stop_frac": stop_frac,
+        "stop_price": price * (1 - p.direction * stop_frac),
+        "target_price": price * (1 + p.direction * stop_frac * p.reward_risk) if p.reward_risk > 0 else np.nan,
+        "notional": notional,
+        "units": notional / price,
+        "margin": notional / p.leverage,
+        "risk_amount": notional * stop_frac,
+        "exposure": notional / p.account_value,
+        "binding": binding,
+    }
+
+
+def simulate_paths(returns, stop_frac, exposure, p, bars_per_day, days=20, days_per_week=7,
+                   n_paths=20000, block=10, max_steps=400, checkpoints=60, seed=0):
+    """批量模拟 n_paths 条资金曲线（各路径在一个二维状态数组中同步推进）
+
+    - returns：历史单根K线简单收益率；按长度为 block 的块做环形自助抽样（块可跨越序列末尾回到开头），
+      保留波动聚集，且每根K线被抽中的概率相同，去均值后的样本不会因首尾欠采样而带上漂移；
+    - 始终持仓（固定比例复利：每笔按当前权益 × exposure 开仓），按收盘价触发止损/止盈（含跳空滑点），
+      平仓后下一根立即按同一规则重新开仓；
+    - 触及日/周亏损阈值时平仓并停止交易至下一日/周；权益跌破 ruin_pct 或爆仓视为破产，不再交易；
+    - 模拟步数超过 max_steps 时，把连续 k 根K线合并为一步（重叠窗口的累计收益）；步内仍按每根K线的收盘
+      检查止损/止盈，在首次触及的那根收盘成交（含跳空滑点），之后到步末空仓、下一步重新开仓；
+      日/周阈值与破产只在步末检查；
+    - 块长限制在样本长度的 1/(4k) 以内，避免各路径重抽同一段行情；模拟期远长于历史样本时，
+      结果主要是对有限样本的重复抽样（stats 中 horizon_bars / history_bars 供调用方提示）。
+    返回统计量字典与资金曲线分位数（用于扇形图）。
+    """
+    r = np.asarray(returns, dtype=float)
+    r = r[np.isfinite(r)]
+    if len(r) < 10:
+        return None
+    n_hist = len(r)
+    horizon = int(bars_per_day * days)
+    k = max(1, int(np.ceil(horizon / max_steps)))
+    # cum[t, i]：从第 t 根起（环形）连续 i+1 根K线的累计收益；一步取一行，末列即该步收益，行内极值用于判断步内是否触及止损/止盈
+    lr = np.log1p(np.concatenate([r, r[:k - 1]]))
+    cs = np.concatenate([[0.0], np.cumsum(lr)])
+    cum = np.expm1(np.lib.stride_tricks.sliding_window_view(cs[1:], k) - cs[:-k, None])
+    r, r_lo, r_hi = cum[:, -1], cum.min(axis=1), cum.max(axis=1)
+    steps = int(np.ceil(horizon / k))
+    steps_per_day = max(1, int(round(bars_per_day / k)))
+    steps_per_week = steps_per_day * days_per_week
+    # 块内相邻两步取相隔 k 的窗口（互不重叠），避免同一段行情被重复复利；块跨度 (block-1)·k 不超过样本的 1/4
+    block = max(1, min(block, n_hist // (4 * k)))
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, n_hist, size=(n_paths, int(np.ceil(steps / block))))
+
+    d = p.direction
+    r_adv, r_fav = (r_lo, r_hi) if d == 1 else (r_hi, r_lo)
+    tp = stop_frac * p.reward_risk if p.reward_risk > 0 else np.inf
+    ruin_level = p.ruin_pct / 100
+    daily_lim, weekly_lim = p.daily_loss_limit / 100, p.weekly_loss_limit / 100
+    eq = np.ones(n_paths)                  # 权益（以初始资金为 1）
+    entry_eq = np.ones(n_paths)            # 当前这笔开仓时的权益
+    growth = np.ones(n_paths)              # 当前这笔持仓的价格累计倍数
+    peak = np.ones(n_paths)
+    max_dd = np.zeros(n_paths)
+    day_eq, week_eq = np.ones(n_paths), np.ones(n_paths)
+    halted_day = np.zeros(n_paths, dtype=bool)
+    halted_week = np.zeros(n_paths, dtype=bool)
+    ruined = np.zeros(n_paths, dtype=bool)
+    day_hits = np.zeros(n_paths, dtype=np.int32)
+    week_hits = np.zeros(n_paths, dtype=np.int32)
+    trades = np.zeros(n_paths, dtype=np.int32)
+    stops = np.zeros(n_paths, dtype=np.int32)
+    ckpt_at = set(np.linspace(0, steps - 1, min(checkpoints, steps)).astype(int).tolist())
+    fan_t, fan_q = [], []
+
+    for j in range(steps):
+        if j and j % steps_per_day == 0:
+            day_eq[:] = eq
+            halted_day[:] = False
+        if j and j % steps_per_week == 0:
+            week_eq[:] = eq
+            halted_week[:] = False
+        active = ~(halted_day | halted_week | ruined)
+        idx = (starts[:, j // block] + (j % block) * k) % n_hist
+        hit_stop = active & (d * (growth * (1 + r_adv[idx]) - 1) <= -stop_frac)
+        hit_tp = active & (d * (growth * (1 + r_fav[idx]) - 1) >= tp)
+        hit = np.flatnonzero(hit_stop | hit_tp)
+        path = d * (growth[hit, None] * (1 + cum[idx[hit]]) - 1)  # 触及的路径：步内各根收盘时的持仓收益
+        growth = np.where(active, growth * (1 + r[idx]), growth)
+        trade_ret = d * (growth - 1)
+        if len(hit):  # 取先触及的一侧，在那根收盘成交（k = 1 时即本步收盘）
+            rows = np.arange(len(hit))
+            s_hit, t_hit = path <= -stop_frac, path >= tp
+            s_at, t_at = s_hit.argmax(axis=1), t_hit.argmax(axis=1)
+            s_at[~s_hit[rows, s_at]] = k
+            t_at[~t_hit[rows, t_at]] = k
+            trade_ret[hit] = path[rows, np.minimum(s_at, t_at)]
+            hit_stop[hit], hit_tp[hit] = s_at < t_at, t_at < s_at
+        eq = np.where(active, entry_eq * np.maximum(1 + exposure * trade_ret, 0.0), eq)
+
+        # 出场：止损 / 止盈 / 日周阈值 / 破产
+        hit_day = active & (eq <= day_eq * (1 - daily_lim))
+        hit_week = active & (eq <= week_eq * (1 - weekly_lim))
+        now_ruined = active & (eq <= ruin_level)
+        exit_ = hit_stop | hit_tp | hit_day | hit_week | now_ruined
+        trades += exit_
+        stops += hit_stop
+        day_hits += hit_day
+        week_hits += hit_week
+        halted_day |= hit_day
+        halted_week |= hit_week
+        ruined |= now_ruined
+        entry_eq = np.where(exit_, eq, entry_eq)
+        growth = np.where(exit_, 1.0, growth)
+
+        peak = np.maximum(peak, eq)
+        max_dd = np.maximum(max_dd, 1 - eq / peak)
+        if j in ckpt_at:
+            fan_t.append((j + 1) * k)
+            fan_q.append(np.percentile(eq, [5, 25, 50, 75, 95]))
+
+    n_days = max(1, int(np.ceil(steps / steps_per_day)))
+    n_weeks = max(1, int(np.ceil(steps / steps_per_week)))
+    stats = {
+        "paths": n_paths, "steps": steps, "bars_per_step": k, "days": days,
+        "horizon_bars": horizon, "history_bars": n_hist,
+        "risk_of_ruin": float(ruined.mean()),
+        "p_daily_limit": float((day_hits > 0).mean()),
+        "daily_limit_freq": float(day_hits.sum() / (n_paths * n_days)),
+        "p_weekly_limit": float((week_hits > 0).mean()),
+        "weekly_limit_freq": float(week_hits.sum() / (n_paths * n_weeks)),
+        "max_dd_mean": float(max_dd.mean()),
+        "max_dd_p95": float(np.percentile(max_dd, 95)),
+        "final_p5": float(np.percentile(eq, 5)), "final_p50": float(np.median(eq)),
+        "final_p95": float(np.percentile(eq, 95)), "final_mean": float(eq.mean()),
+        "p_loss": float((eq < 1).mean()),
+        "trades_mean": float(trades.mean()),
+        "stop_rate": float(stops.sum() / max(trades.sum(), 1)),
+    }
+    fan = {"bars": np.asarray(fan_t), "quantiles": np.asarray(fan_q) if fan_q else np.empty((0, 5))}
+    return stats, fan
@@ -0,0 +1,181 @@
+# shm_cache.py — 主机级共享K线/指标缓存：NumPy memmap 文件 + 原子切换，多个 Streamlit 进程零拷贝共享
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows 无 flock，退化为不加锁
+    fcntl = None
+
+
+def default_root():
+    """优先放在 /dev/shm（内存文件系统），否则用系统临时目录"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else os.environ.get("TMPDIR", "/tmp")
+    return os.path.join(base, "lqt-shared-cache")
+
+
+class SharedFrameCache:
+    """跨进程共享的 DataFrame 缓存
+
+    目录结构：<root>/<key哈希>/CURRENT（小索引：当前版本、创建时间、行数）
+                              /<版本>/index.npy, data.npy, meta.json
+    - 写入：先完整写出新版本目录，再以 os.replace 原子替换 CURRENT，读者不会看到半成品；
+    - 读取：np.load(mmap_mode="r") 映射 data.npy（列优先存储），DataFrame 直接引用映射页，
+      同一主机上的所有进程共享同一份物理内存；
+    - 同一 key 的加载用 flock 串行化（single-flight），N 个副本只会向上游请求一次；
+    - 写入时顺带（每 sweep_every_s 秒至多一次）清扫根目录：删除过期超过 keep_old_s 的 key 目录，
+      并在条目数超过 max_entries 时按创建时间淘汰最旧的，键中含数据版本号的条目不会无限累积。
+    只支持数值/布尔列，含其他类型列的 DataFrame 不写入共享缓存。
+    """
+
+    def __init__(self, root=None, ttl=900, keep_old_s=120, max_entries=512, sweep_every_s=60):
+        self.root = root or default_root()
+        self.ttl = ttl
+        self.keep_old_s = keep_old_s
+        self.max_entries = max_entries
+        self.sweep_every_s = sweep_every_s
+        self._last_sweep = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, key):
+        return os.path.join(self.root, hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:24])
+
+    def _read_current(self, kdir):
+        try:
+            with open(os.path.join(kdir, "CURRENT"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key):
+        """命中且未过期时返回映射到共享内存的只读 DataFrame，否则返回 None"""
+        kdir = self._dir(key)
+        cur = self._read_current(kdir)
+        if cur is None or time.time() - cur["created"] > self.ttl:
+            return None
+        vdir = os.path.join(kdir, cur["version"])
+        try:
+            with open(os.path.join(vdir, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            index = np.load(os.path.join(vdir, "index.npy"), mmap_mode="r")
+            data = np.load(os.path.join(vdir, "data.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        idx = pd.DatetimeIndex(np.asarray(index).view("M8[ns]"), name=meta["index_name"])
+        if meta["tz"]:
+            idx = idx.tz_localize("UTC").tz_convert(meta["tz"])
+        # 每列都是映射页上的连续视图；非浮点列（布尔/整数）转换回原类型，只复制这几列
+        cols = {}
+        for j, col in enumerate(meta["columns"]):
+            dtype = meta["dtypes"][col]
+            cols[col] = data[:, j] if dtype == "float64" else data[:, j].astype(dtype)
+        df = pd.DataFrame(cols, index=idx, copy=False)
+        df.attrs["shared_version"] = cur["version"]
+        return df
+
+    def put(self, key, df):
+        """写入新版本并原子切换；不支持的列类型返回 False"""
+        if not isinstance(df, pd.DataFrame) or df.empty or not isinstance(df.index, pd.DatetimeIndex):
+            return False
+        if isinstance(df.columns, pd.MultiIndex) or not all(
+                pd.api.types.is_numeric_dtype(t) or pd.api.types.is_bool_dtype(t) for t in df.dtypes):
+            return False
+        kdir = self._dir(key)
+        os.makedirs(kdir, exist_ok=True)
+        version = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        vdir = os.path.join(kdir, version)
+        os.makedirs(vdir)
+        idx = df.index
+        tz = str(idx.tz) if idx.tz is not None else ""
+        ns = (idx.tz_convert("UTC").tz_localize(None) if tz else idx).as_unit("ns").asi8
+        np.save(os.path.join(vdir, "index.npy"), ns)
+        # 列优先（Fortran）存储：映射后每列都是连续内存，pandas 无需复制即可引用
+        arr = np.lib.format.open_memmap(os.path.join(vdir, "data.npy"), mode="w+", dtype="float64",
+                                        shape=df.shape, fortran_order=True)
+        for j, col in enumerate(df.columns):
+            arr[:, j] = df[col].to_numpy(dtype="float64", na_value=np.nan)
+        arr.flush()
+        del arr
+        meta = {"columns": [str(c) for c in df.columns], "dtypes": {str(c): str(t) for c, t in df.dtypes.items()},
+                "tz": tz, "index_name": idx.name}
+        with open(os.path.join(vdir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        cur = {"version": version, "created": time.time(), "rows": len(df), "cols": df.shape[1], "key": repr(key)[:300]}
+        tmp = os.path.join(kdir, f"CURRENT.tmp{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cur, f)
+        os.replace(tmp, os.path.join(kdir, "CURRENT"))
+        self._cleanup(kdir, version)
+        if time.time() - self._last_sweep > self.sweep_every_s:
+            self.sweep()
+        return True
+
+    def _cleanup(self, kdir, current):
+        # 旧版本延迟删除；已映射的进程在 POSIX 上仍持有 inode，删除不影响其读取
+        now = time.time()
+        for name in os.listdir(kdir):
+            path = os.path.join(kdir, name)
+            if name != current and os.path.isdir(path) and now - os.path.getmtime(path) > self.keep_old_s:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def sweep(self):
+        """删除已过期（created + ttl + keep_old_s 之前）或无 CURRENT 且长期未修改的 key 目录；超出 max_entries 时淘汰最旧的"""
+        now = time.time()
+        self._last_sweep = now
+        live = []
+        for name in os.listdir(self.root):
+            kdir = os.path.join(self.root, name)
+            if not os.path.isdir(kdir):
+                continue
+            cur = self._read_current(kdir)
+            try:
+                created = cur["created"] if cur else os.path.getmtime(kdir)
+            except OSError:
+                continue
+            if now - created > self.ttl + self.keep_old_s:
+                shutil.rmtree(kdir, ignore_errors=True)
+            elif cur:
+                live.append((created, kdir))
+        for _, kdir in sorted(live)[:max(0, len(live) - self.max_entries)]:
+            shutil.rmtree(kdir, ignore_errors=True)
+
+    def get_or_load(self, key, loader):
+        """命中直接返回；未命中时加文件锁，只有一个进程执行 loader，其余进程等待后读取其结果"""
+        df = self.get(key)
+        if df is not None:
+            return df
+        kdir = self._dir(key)
+        os.makedirs(kdir, exist_ok=True)
+        with open(os.path.join(kdir, "LOCK"), "a") as lockf:
+            if fcntl is not None:
+                fcntl.flock(lockf, fcntl.LOCK_EX)
+            try:
+                df = self.get(key)
+                if df is not None:
+                    return df
+                fresh = loader()
+                if self.put(key, fresh):
+                    shared = self.get(key)
+                    if shared is not None:
+                        return shared
+                return fresh
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lockf, fcntl.LOCK_UN)
+
+    def entries(self):
+        rows = []
+        for name in os.listdir(self.root):
+            cur = self._read_current(os.path.join(self.root, name))
+            if cur:
+                rows.append({"key": cur["key"], "rows": cur["rows"], "cols": cur["cols"],
+                             "age_s": round(time.time() - cur["created"], 1),
+                             "expired": time.time() - cur["created"] > self.ttl})
+        return pd.DataFrame(rows)
@@ -0,0 +1,218 @@
+# sources.py — 各数据源的原始请求与解析（不依赖 Streamlit，可供后台告警/回放进程复用）
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+import yfinance as yf
+
+from resample import resample_ohlcv
+
+OKX_PUBLIC_BASES = ["https://www.okx.com", "https://aws.okx.com"]
+
+# 单次请求允许的最大时间跨度（天）：超过的区间按块拆分
+FINNHUB_CHUNK_DAYS = {"1": 7, "5": 30, "15": 30, "30": 60, "60": 90, "D": 3650, "W": 3650, "M": 3650}
+# Yahoo 分钟线：(单次请求最大天数, 最远可回溯天数)
+YF_INTRADAY_LIMITS = {"1m": (7, 30), "2m": (60, 60), "5m": (60, 60), "15m": (60, 60), "30m": (60, 60),
+                      "90m": (60, 60), "60m": (365, 730), "1h": (365, 730)}
+
+
+class RateLimiter:
+    """令牌桶：限制对上游的请求速率（如 OKX 公共K线接口约 20 次/2 秒）"""
+
+    def __init__(self, rate, burst=None):
+        self.rate, self.capacity = rate, burst or rate
+        self.tokens, self.t = float(self.capacity), time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _cancelled(cancel):
+    return cancel is not None and cancel.is_set()
+
+
+def parse_ohlc_rows(arr):
+    rows = [(pd.to_datetime(x[0], unit="ms"), float(x[1]), float(x[2]), float(x[3]), float(x[4])) for x in arr]
+    return pd.DataFrame(rows, columns=["Date","Open","High","Low","Close"]).set_index("Date")
+
+
+def fetch_cg_ohlc(coin_id, days, timeout=20, cancel=None):
+    url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/ohlc"
+    r = requests.get(url, params={"vs_currency": "usd", "days": days}, timeout=timeout)
+    r.raise_for_status()
+    arr = r.json()
+    if _cancelled(cancel) or not isinstance(arr, list) or not arr:
+        return pd.DataFrame()
+    return parse_ohlc_rows(arr)
+
+
+def fetch_cg_market_chart(coin_id, days, timeout=20, cancel=None):
+    url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart"
+    params = {"vs_currency":"usd", "days": days if days != "max" else "365"}
+    r = requests.get(url, params=params, timeout=timeout)
+    r.raise_for_status()
+    prices = r.json().get("prices", [])
+    if _cancelled(cancel) or not prices:
+        return pd.DataFrame()
+    s = pd.Series(
+        [float(p[1]) for p in prices],
+        index=pd.to_datetime([int(p[0]) for p in prices], unit="ms"),
+        name="price"
+    ).sort_index()
+    ohlc = resample_ohlcv(pd.DataFrame({"Open": s, "High": s, "Low": s, "Close": s}), "1D")
+    return ohlc[["Open","High","Low","Close"]]
+
+
+def fetch_tokeninsight(api_base_url, coin_id, timeout=15, cancel=None):
+    url = f"{api_base_url.rstrip('/')}/ohlc"
+    r = requests.get(url, params={"symbol": coin_id, "period": "1d"}, timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+    if _cancelled(cancel) or not isinstance(data, list) or not data:
+        return pd.DataFrame()
+    return parse_ohlc_rows(data)
+
+
+def fetch_okx(base_url, instId, bar, timeout=20, cancel=None, limit=1000):
+    url = base_url.rstrip('/') + "/api/v5/market/candles"
+    params = {"instId": instId, "bar": bar, "limit": str(limit)}
+    r = requests.get(url, params=params, timeout=timeout)
+    r.raise_for_status()
+    data = r.json().get("data", [])
+    if _cancelled(cancel) or not data: return pd.DataFrame()
+    rows = []
+    for a in reversed(data):
+        ts = int(a[0]); o=float(a[1]); h=float(a[2]); l=float(a[3]); c=float(a[4]); v=float(a[5])
+        rows.append((pd.to_datetime(ts, unit="ms"), o,h,l,c,v))
+    return pd.DataFrame(rows, columns=["Date","Open","High","Low","Close","Volume"]).set_index("Date")
+
+
+def _flatten_yf(df):
+    # 新版 yfinance 单标的下载也返回 (字段, 代码) 两级列
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.copy()
+        df.columns = df.columns.get_level_values(0)
+    return df
+
+
+def fetch_yf(symbol, interval="1d", period="5y"):
+    df = _flatten_yf(yf.download(symbol, period=period, interval=interval, progress=False, auto_adjust=False))
+    if not df.empty:
+        df = df[["Open","High","Low","Close","Volume"]].dropna()
+    return df
+
+
+def fetch_yf_range(symbol, interval, start, end, timeout=20):
+    """按起止时间（秒）请求一段 Yahoo K线；失败时抛出异常（不把失败当作空数据缓存）"""
+    df = yf.Ticker(symbol).history(interval=interval, start=pd.Timestamp(start, unit="s"), end=pd.Timestamp(end, unit="s"),
+                                   auto_adjust=False, actions=False, timeout=timeout, raise_errors=True)
+    if df.empty:
+        return pd.DataFrame(columns=["Open","High","Low","Close","Volume"])
+    df = _flatten_yf(df)[["Open","High","Low","Close","Volume"]].dropna()
+    df.index.name = "Date"
+    return df
+
+
+def fetch_finnhub_range(symbol, resolution, start, end, api_key, timeout=20):
+    """按起止时间（秒）请求一段 Finnhub K线；s=no_data 返回空表，其他非 ok 状态抛出异常"""
+    params = {"symbol": symbol, "resolution": resolution, "from": int(start), "to": int(end), "token": api_key}
+    r = requests.get("https://finnhub.io/api/v1/stock/candle", params=params, timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+    if data.get("s") == "no_data":
+        return pd.DataFrame(columns=["Open","High","Low","Close","Volume"])
+    if data.get("s") != "ok":
+        raise ValueError(data.get("error") or f"Finnhub 返回状态 {data.get('s')}")
+    df = pd.DataFrame({
+        "Date": pd.to_datetime(data["t"], unit="s"),
+        "Open": data["o"],
+        "High": data["h"],
+        "Low": data["l"],
+        "Close": data["c"],
+        "Volume": data["v"]
+    })
+    return df.set_index("Date")
+
+
+def plan_chunks(start, end, span):
+    """把 [start, end)（秒）按固定对齐的 span 切块
+
+    块边界只取决于 span，与请求区间无关：同一时间段总落在同一块里，
+    区间重叠的再次请求可直接复用已缓存的块，只需拉取缺失的块。
+    """
+    span = int(span)
+    first = int(start) // span * span
+    return [(s, s + span) for s in range(first, int(end), span)]
+
+
+def _epoch_seconds(index):
+    idx = pd.DatetimeIndex(index)
+    if idx.tz is not None:
+        idx = idx.tz_convert("UTC").tz_localize(None)
+    return idx.as_unit("ns").asi8 // 10**9
+
+
+def fetch_chunked(fetch_chunk, chunks, start=None, end=None, workers=4, limiter=None):
+    """并发拉取各块，按时间拼接去重并裁剪到 [start, end]
+
+    limiter 为调用方持有的 RateLimiter（应在多次调用、多个会话间共用同一个，限速才对整个进程生效）；
+    fetch_chunk 自行限速（例如只在缓存未命中、真正发请求时取令牌）时传 None。
+    返回 (DataFrame, 失败块列表[(块, 异常)])；部分块失败时仍返回其余块的数据。
+    """
+    def one(ch):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return ch, fetch_chunk(*ch), None
+        except Exception as e:
+            return ch, None, e
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        results = list(pool.map(one, chunks))
+    parts = [df for _, df, _ in results if df is not None and not df.empty]
+    failed = [(ch, err) for ch, _, err in results if err is not None]
+    if not parts:
+        return pd.DataFrame(), failed
+    out = pd.concat(parts).sort_index()
+    out = out[~out.index.duplicated(keep="last")]
+    if start is not None or end is not None:
+        sec = _epoch_seconds(out.index)
+        out = out[(sec >= (start if start is not None else sec.min())) & (sec <= (end if end is not None else sec.max()))]
+    return out, failed
+
+
+def fetch_okx_closes(base_url, instIds, bar, limit=300, workers=8, rate=10.0):
+    """并发拉取多个 OKX 标的的收盘价，返回 {instId: Series}；单个标的失败时跳过"""
+    limiter = RateLimiter(rate)
+
+    def one(inst):
+        limiter.acquire()
+        try:
+            return inst, fetch_okx(base_url, inst, bar, timeout=15, limit=limit)["Close"]
+        except Exception:
+            return inst, None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return {k: v for k, v in pool.map(one, instIds) if v is not None and len(v)}
+
+
+def fetch_yf_closes(symbols, interval="1d", period="2y"):
+    """一次请求批量下载多个 Yahoo 标的的收盘价，返回 {symbol: Series}"""
+    df = yf.download(list(symbols), period=period, interval=interval, progress=False, auto_adjust=False,
+                     group_by="column", threads=True)
+    if df.empty:
+        return {}
+    closes = df["Close"]
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(symbols[0])
+    return {str(c): closes[c].dropna() for c in closes.columns if closes[c].notna().any()}
@@ -0,0 +1,135 @@
+# vwap.py — 会话重置 VWAP / 锚定 VWAP 及标准差带（分段累计和，单次向量化计算，可增量更新）
+import numpy as np
+import pandas as pd
+
+from resample import bucket_keys
+
+RESET_MODES = {
+    "会话重置（日）": "1D",
+    "周重置": "1W",
+    "月重置": "1M",
+    "全历史（累计）": None,
+}
+
+
+def typical_price(df):
+    """优先使用重采样得到的 PV/Volume（真实成交均价），否则用 (H+L+C)/3"""
+    tp = (df["High"] + df["Low"] + df["Close"]) / 3
+    if "PV" in df.columns and "Volume" in df.columns:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tp = (df["PV"] / df["Volume"]).where(df["Volume"] > 0, tp)
+    return tp.to_numpy(dtype=float)
+
+
+def segment_ids(index, reset, session=None):
+    """按重置周期（'1D'/'1W'/'1M' 或 None）给每根K线分配段号；session 决定按哪个时区切日"""
+    if reset is None:
+        return np.zeros(len(index), dtype=np.int64)
+    keys, _, _ = bucket_keys(index, reset, session)
+    return keys
+
+
+def _segment_starts(seg):
+    """每根K线所在段的起始下标"""
+    n = len(seg)
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = seg[1:] != seg[:-1]
+    return np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+
+
+def _seg_cumsum(x, start):
+    """分段累计和：全局 cumsum 减去段起点之前的累计值（一次遍历）"""
+    cs = np.cumsum(x)
+    before = np.where(start > 0, cs[start - 1], 0.0)
+    return cs - before
+
+
+def segmented_vwap(tp, vol, seg):
+    """按段重置的 VWAP 与成交量加权标准差，返回 (vwap, std)
+
+    以每段第一根K线的价格为参考价做平移后再累计（shifted data），
+    避免长历史下 Σv·p、Σv·p² 数值过大造成的抵消误差。
+    """
+    tp = np.asarray(tp, dtype=float)
+    vol = np.nan_to_num(np.asarray(vol, dtype=float))
+    start = _segment_starts(np.asarray(seg))
+    ref = tp[start]
+    d = np.nan_to_num(tp - ref)
+    sv = _seg_cumsum(vol, start)
+    svd = _seg_cumsum(vol * d, start)
+    svd2 = _seg_cumsum(vol * d * d, start)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_d = np.where(sv > 0, svd / sv, np.nan)
+        var = np.where(sv > 0, svd2 / sv - mean_d ** 2, np.nan)
+    return ref + mean_d, np.sqrt(np.maximum(var, 0.0))
+
+
+def anchored_vwaps(tp, vol, anchors):
+    """一次性计算多个锚点的 VWAP 与标准差，返回 shape=(锚点数, n) 的 (vwap, std)，锚点之前为 NaN
+
+    anchors 为起始下标列表。所有锚点共用一组全局累计和（以全序列中位价平移），
+    锚点 j 在 t 处的值 = (CS[t] - CS[a_j-1]) / (CV[t] - CV[a_j-1])，通过广播一次算出。
+    """
+    tp = np.asarray(tp, dtype=float)
+    vol = np.nan_to_num(np.asarray(vol, dtype=float))
+    n = len(tp)
+    anchors = np.asarray(sorted(set(int(a) for a in anchors if 0 <= int(a) < n)), dtype=np.int64)
+    if not len(anchors) or not n:
+        return np.full((len(anchors), n), np.nan), np.full((len(anchors), n), np.nan)
+    shift = np.nanmedian(tp)
+    d = np.nan_to_num(tp - shift)
+    cv = np.concatenate([[0.0], np.cumsum(vol)])
+    cvd = np.concatenate([[0.0], np.cumsum(vol * d)])
+    cvd2 = np.concatenate([[0.0], np.cumsum(vol * d * d)])
+    a = anchors[:, None]
+    sv = cv[1:][None, :] - cv[a]
+    svd = cvd[1:][None, :] - cvd[a]
+    svd2 = cvd2[1:][None, :] - cvd2[a]
+    active = np.arange(n)[None, :] >= a
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_d = np.where(active & (sv > 0), svd / sv, np.nan)
+        var = np.where(active & (sv > 0), svd2 / sv - mean_d ** 2, np.nan)
+    return shift + mean_d, np.sqrt(np.maximum(var, 0.0))
+
+
+def anchor_positions(index, anchor_times):
+    """把锚定时间转为K线下标（取不早于该时间的第一根）；越界的忽略"""
+    idx = pd.DatetimeIndex(index)
+    pos = []
+    for t in anchor_times:
+        ts = pd.Timestamp(t)
+        if idx.tz is not None and ts.tz is None:
+            ts = ts.tz_localize(idx.tz)
+        elif idx.tz is None and ts.tz is not None:
+            ts = ts.tz_convert("UTC").tz_localize(None)
+        p = int(idx.searchsorted(ts))
+        if p < len(idx):
+            pos.append(p)
+    return pos
+
+
+class IncrementalVWAP:
+    """可增量更新的分段 VWAP：新K线到来时 O(1) 更新，段号变化时自动重置
+
+    与 segmented_vwap 使用相同的参考价平移，结果一致。
+    """
+
+    def __init__(self):
+        self.segment = None
+        self.ref = np.nan
+        self.sv = self.svd = self.svd2 = 0.0
+
+    def update(self, segment, tp, vol):
+        """加入一根已收盘K线，返回 (vwap, std)"""
+        if segment != self.segment:
+            self.segment, self.ref = segment, tp
+            self.sv = self.svd = self.svd2 = 0.0
+        vol = 0.0 if vol is None or np.isnan(vol) else float(vol)
+        d = 0.0 if np.isnan(tp - self.ref) else tp - self.ref
+        self.sv += vol
+        self.svd += vol * d
+        self.svd2 += vol * d * d
+        if self.sv <= 0:
+            return np.nan, np.nan
+        mean_d = self.svd / self.sv
+        return self.ref + mean_d, float(np.sqrt(max(self.svd2 / self.sv - mean_d ** 2, 0.0)))
@@ -0,0 +1,139 @@
+# zigzag.py — ZigZag 波段识别（百分比 / ATR 阈值，单次遍历 O(n)）与多波段斐波那契回撤/扩展位
+import numpy as np
+import pandas as pd
+
+RETRACEMENTS = [0, 0.236, 0.382, 0.5, 0.618, 0.786, 1]
+EXTENSIONS = [1.272, 1.618, 2.618]
+PIVOT_COLUMNS = ["pos", "price", "dir", "confirm_pos"]
+
+
+def wilder_atr(high, low, close, window=14, min_periods=None):
+    """Wilder 平滑的 ATR（ewm alpha=1/window），前 min_periods-1 根为 NaN（默认 window，与 ta 一致）"""
+    h, l, c = (np.asarray(a, dtype=float) for a in (high, low, close))
+    prev = np.concatenate([[np.nan], c[:-1]])
+    tr = np.fmax(h - l, np.fmax(np.abs(h - prev), np.abs(l - prev)))
+    return pd.Series(tr).ewm(alpha=1 / window, adjust=False, min_periods=min_periods or window).mean().to_numpy()
+
+
+class ZigZag:
+    """增量 ZigZag：逐根喂入 (high, low, atr)，价格从当前极值反向运动超过阈值时确认该极值为拐点
+
+    阈值为极值价格 × pct% 或 atr_mult × 极值所在K线的 ATR（在极值形成时固定，追踪期间不随 ATR 漂移，
+    保证拐点就是上一拐点到确认K线之间的最高/最低点；该 ATR 为 NaN 时用当前 ATR，阈值不再固定，
+    该保证可能不成立，swing_pivots 因此使用从首根K线起即有值的 ATR）。
+    尚未定向时同时追踪最高/最低点，以及各自之后出现的最低/最高点，首个拐点确认后以后者作为下一段的初始极值。
+    状态只有“方向 + 未确认极值”，每根K线 O(1)；批量计算 swing_pivots 与实时逐根更新共用同一套规则，结果一致。
+    同一根K线既创新高又回撤超过阈值时按“先延伸极值”处理（K线内先后顺序未知）。
+    """
+
+    def __init__(self, pct=None, atr_mult=None):
+        self.pct, self.atr_mult = pct, atr_mult
+        self.dir = 0              # 1 = 上行段（追踪最高点），-1 = 下行段（追踪最低点），0 = 尚未定向
+        self.ext = None           # 未确认极值 (位置, 价格, 极值K线的 ATR)
+        self.hi = self.lo = None  # 尚未定向时同时追踪的最高/最低点
+        self.after_hi = self.after_lo = None  # 最高点之后的最低点 / 最低点之后的最高点（不含极值K线本身）
+        self.last = None          # 最近一个已确认拐点 (位置, 价格, 方向, 确认位置)
+        self.n = 0
+
+    def _thr(self, ext, atr):
+        if self.pct:
+            return ext[1] * self.pct / 100
+        return self.atr_mult * (atr if np.isnan(ext[2]) else ext[2])
+
+    def _confirm(self, ext, d, i):
+        self.last = (ext[0], ext[1], d, i)
+        return self.last
+
+    def update(self, high, low, atr=np.nan):
+        """送入一根已收盘K线；确认新拐点时返回 (位置, 价格, 1 高点 / -1 低点, 确认位置)，否则返回 None"""
+        i = self.n
+        self.n += 1
+        if self.dir == 0:
+            if self.hi is None:
+                self.hi, self.lo = (i, high, atr), (i, low, atr)
+                return None
+            if high > self.hi[1]:
+                self.hi, self.after_hi = (i, high, atr), None
+            elif self.after_hi is None or low < self.after_hi[1]:
+                self.after_hi = (i, low, atr)
+            if low < self.lo[1]:
+                self.lo, self.after_lo = (i, low, atr), None
+            elif self.after_lo is None or high > self.after_lo[1]:
+                self.after_lo = (i, high, atr)
+            down = self.hi[0] < i and self.hi[1] - low >= self._thr(self.hi, atr)
+            up = self.lo[0] < i and high - self.lo[1] >= self._thr(self.lo, atr)
+            if down and (not up or self.hi[0] <= self.lo[0]):
+                self.dir, self.ext = -1, self.after_hi
+                return self._confirm(self.hi, 1, i)
+            if up:
+                self.dir, self.ext = 1, self.after_lo
+                return self._confirm(self.lo, -1, i)
+            return None
+        if self.dir == 1:
+            if high > self.ext[1]:
+                self.ext = (i, high, atr)
+            elif self.ext[1] - low >= self._thr(self.ext, atr):
+                p = self._confirm(self.ext, 1, i)
+                self.dir, self.ext = -1, (i, low, atr)
+                return p
+        else:
+            if low < self.ext[1]:
+                self.ext = (i, low, atr)
+            elif high - self.ext[1] >= self._thr(self.ext, atr):
+                p = self._confirm(self.ext, -1, i)
+                self.dir, self.ext = 1, (i, high, atr)
+                return p
+        return None
+
+
+def swing_pivots(df, mode="atr", threshold=3.0, atr_window=14):
+    """整段K线 → 已确认拐点表（按确认顺序，亦即按时间排序）
+
+    索引为拐点所在K线时间；列：pos（K线位置）、price、dir（1 高点 / -1 低点）、confirm_pos（确认所在K线位置）。
+    相邻两个拐点构成一个波段；拐点只依赖确认位置及之前的K线，截取前缀即为当时实时看到的结果。
+    """
+    h = df["High"].to_numpy(dtype=float)
+    l = df["Low"].to_numpy(dtype=float)
+    if mode == "atr":
+        # 预热期也给出 ATR（按已有K线的 Wilder 平滑），每个极值的阈值从一开始就固定，拐点恒为两次确认之间的极值
+        atr = wilder_atr(h, l, df["Close"], int(atr_window), min_periods=1)
+        zz = ZigZag(atr_mult=float(threshold))
+    else:
+        atr = np.full(len(h), np.nan)
+        zz = ZigZag(pct=float(threshold))
+    update = zz.update
+    rows = [p for p in map(update, h, l, atr) if p is not None]
+    out = pd.DataFrame(rows, columns=PIVOT_COLUMNS).astype(
+        {"pos": "int64", "price": "float64", "dir": "int64", "confirm_pos": "int64"})
+    out.index = df.index[out["pos"].to_numpy()]
+    return out
+
+
+def swing_legs(pivots, n, high, low, k=3):
+    """截至第 n 根K线（位置 < n）已确认的最近 k 个波段，以及最后一个拐点之后仍在进行中的波段
+
+    confirm_pos 单调递增，二分查找定位可见的拐点，每次 O(log 拐点数 + 进行中波段长度)，
+    新K线到来或回放推进时无需重算全部拐点。波段为 dict：start/end 为K线位置，direction 1 上行 / -1 下行。
+    """
+    m = int(np.searchsorted(pivots["confirm_pos"].to_numpy(), n - 1, side="right"))
+    pos = pivots["pos"].to_numpy()[:m]
+    price = pivots["price"].to_numpy()[:m]
+    legs = [{"start": int(pos[j]), "start_price": float(price[j]), "end": int(pos[j + 1]),
+             "end_price": float(price[j + 1]), "direction": 1 if price[j + 1] > price[j] else -1}
+            for j in range(max(0, m - 1 - k), m - 1)]
+    live = None
+    if m and pos[m - 1] + 1 < n:
+        p0, d = int(pos[m - 1]), int(pivots["dir"].iat[m - 1])
+        seg = np.asarray(high[p0 + 1:n] if d == -1 else low[p0 + 1:n], dtype=float)
+        j = int(np.argmax(seg) if d == -1 else np.argmin(seg))
+        live = {"start": p0, "start_price": float(price[m - 1]), "end": p0 + 1 + j,
+                "end_price": float(seg[j]), "direction": -d}
+    return legs, live
+
+
+def fib_levels(leg, retracements=RETRACEMENTS, extensions=EXTENSIONS):
+    """波段 A→B 的斐波那契价位：回撤 r 对应 B − (B−A)·r（0 = B，1 = A），扩展 e 对应 A + (B−A)·e（沿波段方向超出 B）"""
+    a, b = leg["start_price"], leg["end_price"]
+    out = {f"{r * 100:.1f}%": b - (b - a) * r for r in retracements}
+    out.update({f"{e * 100:.1f}%": a + (b - a) * e for e in extensions})
+    return out